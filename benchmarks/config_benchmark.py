@@ -0,0 +1,192 @@
+"""
+Measures each phase of loading a config: time (best of several runs) and peak memory (tracemalloc, separate run).
+The phases are the ones ConfigParser and Snapshot time in the stats (config.*, snapshot.*).
+The config is generated with the given shape (see config_generator.py) or read from a file.
+Results are appended to a JSON lines file and compared with the last result of the same shape and config,
+to follow the loading costs across versions. Needs Python 3.9 or newer.
+
+    python benchmarks/config_benchmark.py --modes 200 --schemes 1000
+    python benchmarks/config_benchmark.py --config ~/.config/i3razer/config.yaml
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# the working tree is measured, not an installed i3razer
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yaml import safe_dump as yaml_dump  # noqa: E402
+
+from config_generator import add_shape_arguments, generate_config, shape_from_args  # noqa: E402
+from i3razer import __version__, config_parser  # noqa: E402
+from i3razer.config_parser import ConfigParser  # noqa: E402
+from i3razer.layout import layouts  # noqa: E402
+from i3razer.snapshot import Snapshot  # noqa: E402
+from i3razer.stats import stats  # noqa: E402
+
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+ROWS, COLS = 6, 22  # matrix of a full size keyboard
+PHASE_PREFIXES = ("config.", "snapshot.")
+
+
+def load(config_file, logger, cached=False):
+    """
+    reads the config and builds its snapshot, like i3razer on start (cached=False) or on a reload
+    """
+    if not cached:
+        config_parser._parsed_files.clear()
+    config = ConfigParser(config_file, logger)
+    if not config.is_integral():
+        raise ValueError(f"config '{config_file}' has errors")
+    Snapshot(config, "en_US", layouts["en_US"], ROWS, COLS, logger)
+
+
+@contextmanager
+def traced_phases(peaks):
+    """
+    while active, the phases timed in the stats also record their peak of allocated memory in peaks
+    (phase name -> bytes above the memory allocated when the phase started)
+    """
+    timed = stats.timed
+
+    @contextmanager
+    def traced(name):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        with timed(name):
+            yield
+        peaks[name] = max(peaks.get(name, 0), tracemalloc.get_traced_memory()[1] - before)
+
+    stats.timed = traced
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        tracemalloc.stop()
+        del stats.timed
+
+
+def measure(config_file, repeat, logger):
+    """
+    returns phase name -> {"seconds": best time, "peak_bytes": peak of allocated memory}
+    the phases of the parser and the snapshot, the whole first load and a reload with the parse cache
+    """
+    results = {}
+
+    def add(name, seconds):
+        result = results.setdefault(name, {"seconds": seconds})
+        result["seconds"] = min(result["seconds"], seconds)
+
+    for cached in (False, True):
+        total = "total_reload" if cached else "total_load"
+        for run in range(repeat):
+            stats.timings.clear()
+            start = time.perf_counter()
+            load(config_file, logger, cached)
+            add(total, time.perf_counter() - start)
+            if not cached:
+                for name, (calls, seconds, maximum) in stats.timings.items():
+                    if name.startswith(PHASE_PREFIXES):
+                        add(name, seconds)
+        # memory in separate runs, tracing slows down the timed runs and the phases reset the peak
+        tracemalloc.start()
+        try:
+            load(config_file, logger, cached)
+            results[total]["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        if not cached:
+            peaks = {}
+            with traced_phases(peaks):
+                load(config_file, logger, cached)
+            for name, peak in peaks.items():
+                results[name]["peak_bytes"] = peak
+    # phases in the order they ran, the totals last
+    return dict(sorted(results.items(), key=lambda item: item[0].startswith("total")))
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def last_result(results_file, shape, config):
+    """
+    returns the latest result in the results file for the shape and config, None if there is none
+    """
+    last = None
+    try:
+        with open(results_file) as file:
+            for line in file:
+                result = json.loads(line)
+                if result.get("shape") == shape and result.get("config") == config:
+                    last = result
+    except FileNotFoundError:
+        pass
+    return last
+
+
+def report(phases, previous):
+    lines = [f"{'phase':<26} {'time':>10} {'peak memory':>12}" + ("  vs. previous" if previous else "")]
+    for name, result in phases.items():
+        line = f"{name:<26} {1000 * result['seconds']:>8.2f}ms {result['peak_bytes'] / 1024:>10.0f}KB"
+        old = previous and previous["phases"].get(name)
+        if old and old["seconds"]:
+            line += f"  {result['seconds'] / old['seconds']:>5.2f}x time, " \
+                    f"{result['peak_bytes'] / max(1, old['peak_bytes']):>5.2f}x memory"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark loading an i3razer config phase by phase")
+    add_shape_arguments(parser)
+    parser.add_argument("--config", metavar="FILE", help="Measure this config instead of a generated one")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs of each phase, the best is kept")
+    parser.add_argument("--results", metavar="FILE", default=DEFAULT_RESULTS,
+                        help="JSON lines file the results are appended to (default: benchmarks/results.jsonl)")
+    parser.add_argument("--no-save", help="Do not append the results", action="store_true")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("benchmark")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    shape = None if args.config else shape_from_args(args)
+    if args.config:
+        config_file = os.path.abspath(args.config)
+    else:
+        file = tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False)
+        with file:
+            yaml_dump(generate_config(shape), file, sort_keys=False)
+        config_file = file.name
+    try:
+        phases = measure(config_file, args.repeat, logger)
+        size = os.path.getsize(config_file)
+    finally:
+        if not args.config:
+            os.unlink(config_file)
+
+    result = {"version": __version__, "revision": git_revision(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": sys.version.split()[0], "shape": shape, "config": args.config, "bytes": size,
+              "phases": phases}
+    print(f"i3razer {__version__} ({result['revision']}), config of {size / 1024:.0f}KB: "
+          f"{args.config or json.dumps(shape)}")
+    print(report(phases, last_result(args.results, shape, args.config)))
+    if not args.no_save:
+        with open(args.results, "a") as file:
+            file.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
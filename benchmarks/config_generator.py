@@ -0,0 +1,108 @@
+"""
+Generates valid i3razer configs of a controlled shape, e.g. to measure how loading scales with the size of a config.
+
+    python benchmarks/config_generator.py --modes 100 --schemes 500 > large.yaml
+"""
+import argparse
+import os
+import sys
+
+# the working tree is used, not an installed i3razer
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yaml import safe_dump as yaml_dump  # noqa: E402
+
+from i3razer import config_contants as conf  # noqa: E402
+from i3razer.layout import layouts  # noqa: E402
+
+SHAPE = {
+    # name: (default, help)
+    "colors": (16, "number of named colors"),
+    "keysets": (32, "number of key sets"),
+    "nesting": (4, "key sets reference the previous key set in chains of this length"),
+    "schemes": (64, "number of static color schemes"),
+    "inherit": (4, "color schemes inherit from the previous scheme in chains of this length"),
+    "assignments": (6, "key sets or keys colored by each scheme"),
+    "modes": (16, "number of modes besides default"),
+    "mode_inherit": (2, "modes inherit from the previous mode in chains of this length"),
+    "bindings": (8, "hotkeys of each mode, schemes beyond (modes + 1) * bindings are unreachable"),
+}
+
+
+def default_shape() -> dict:
+    return {name: default for name, (default, _) in SHAPE.items()}
+
+
+def generate_config(shape=None, layout="en_US") -> dict:
+    """
+    returns the configuration (as read from yaml) of the given shape, missing values use the defaults of SHAPE
+    """
+    shape = dict(default_shape(), **(shape or {}))
+    keys = sorted(layouts[layout])
+    modifiers = ["super_l", "shift_l", "control_l", "alt_l"]
+
+    colors = {f"color{i}": f"0x{(i * 0x2f4b1d) % 0xffffff:06x}" for i in range(max(1, shape["colors"]))}
+    color_names = list(colors)
+
+    keysets = {}
+    for i in range(shape["keysets"]):
+        members = [keys[(i * 7 + j) % len(keys)] for j in range(4)]
+        if shape["nesting"] > 1 and i % shape["nesting"]:
+            members.append(f"keys{i - 1}")
+        keysets[f"keys{i}"] = ", ".join(members)
+    keyset_names = list(keysets) or keys
+
+    schemes = {}
+    for i in range(max(1, shape["schemes"])):
+        scheme = {conf.all_keys: color_names[i % len(color_names)]} if i % max(1, shape["inherit"]) == 0 else {
+            conf.field_inherit: f"scheme{i - 1}"}
+        for j in range(shape["assignments"]):
+            target = keyset_names[(i + j) % len(keyset_names)] if j % 2 == 0 else keys[(i * 3 + j) % len(keys)]
+            scheme[target] = color_names[(i + j) % len(color_names)]
+        schemes[f"scheme{i}"] = scheme
+    scheme_names = list(schemes)
+
+    mode_names = [conf.mode_default] + [f"mode{i}" for i in range(1, shape["modes"] + 1)]
+    modes = {}
+    for i, name in enumerate(mode_names):
+        mode = {conf.scheme_default: scheme_names[i % len(scheme_names)]}
+        if i and shape["mode_inherit"] > 1 and (i - 1) % shape["mode_inherit"]:
+            mode[conf.field_inherit] = mode_names[i - 1]
+        for j in range(shape["bindings"]):
+            combination = f"{modifiers[j % len(modifiers)]} + {keys[(i + j * 5) % len(keys)]}"
+            # spread over all schemes, schemes no hotkey shows are not compiled
+            mode[combination] = scheme_names[(i * shape["bindings"] + j + 1) % len(scheme_names)]
+        if i == 0:
+            switches = {}
+            for k in range(1, len(mode_names)):
+                # a second key if there are more modes than keys
+                combination = " + ".join(["nothing", "super_l", keys[k % len(keys)]] +
+                                         ([keys[k // len(keys) % len(keys)]] if k >= len(keys) else []))
+                switches[combination] = mode_names[k]
+            mode[conf.field_switch] = switches
+        else:
+            mode[conf.field_switch] = {"nothing + escape": conf.mode_default}
+        modes[name] = mode
+
+    return {conf.sec_color: colors, conf.sec_keys: keysets, conf.sec_color_schemes: schemes, conf.sec_modes: modes}
+
+
+def add_shape_arguments(parser):
+    for name, (default, help_text) in SHAPE.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default,
+                            help=f"{help_text} (default: {default})")
+
+
+def shape_from_args(args) -> dict:
+    return {name: getattr(args, name) for name in SHAPE}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a generated i3razer config to stdout")
+    add_shape_arguments(parser)
+    args = parser.parse_args()
+    yaml_dump(generate_config(shape_from_args(args)), sys.stdout, sort_keys=False)
+
+
+if __name__ == "__main__":
+    main()
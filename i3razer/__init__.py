@@ -2,10 +2,18 @@
 
 import logging
 import os
+import signal
 from argparse import ArgumentParser
 
+from i3razer.control import send_command
+from i3razer.event_record import ReplayHook
+from i3razer.evdev_hook import EvdevHook
+from i3razer.frame_bank import build_frame_banks
 from i3razer.i3_razer import ConfigParser, I3Razer
 from i3razer.map_layout import map_layout
+from i3razer.pyxhook import HookManager
+from i3razer.stats import install_signal_handlers
+from i3razer.status_export import read_status, wait_for_change
 
 from openrazer.client import __version__ as openrazer_version
 
@@ -28,6 +36,56 @@ def main():
     default_config = os.path.join(os.path.dirname(__file__), "example_config.yaml")
     parser.add_argument("-c", "--config", default=default_config, help="Config file")
     parser.add_argument("-l", "--layout", help="Keyboard layout for colored keys. Usually detected automatically")
+    parser.add_argument("--i3-ipc", help="Follow the i3 mode via the i3 IPC socket instead of switch_mode keys",
+                        action="store_true")
+    parser.add_argument("--evdev", metavar="DEVICE", nargs="?", const="",
+                        help="Read keys from the keyboard event device instead of X RECORD, "
+                             "the device is detected if not given")
+    parser.add_argument("--record", metavar="FILE", help="Record all key events to FILE")
+    parser.add_argument("--replay", metavar="FILE", help="Replay the key events recorded in FILE and exit")
+    parser.add_argument("--replay-fast", help="Replay as fast as possible instead of the original timing",
+                        action="store_true")
+    parser.add_argument("--watch", help="Reload the config automatically when it is saved", action="store_true")
+    parser.add_argument("--control", help="Serve the control interface, see --send", action="store_true")
+    parser.add_argument("--control-socket", metavar="FILE",
+                        help="Socket of the control interface, implies --control "
+                             "(default: $XDG_RUNTIME_DIR/i3razer.sock)")
+    parser.add_argument("--send", metavar="COMMAND",
+                        help="Send a command to the control interface of the running i3razer and exit, "
+                             "e.g. 'overlay \"w, a, s, d\" red 5'")
+    parser.add_argument("--fps", type=int, default=30, help="Frame rate of software animations (default: 30)")
+    parser.add_argument("--fade", metavar="SECONDS", type=float, default=0.0,
+                        help="Fade between color schemes instead of switching at once")
+    parser.add_argument("--brightness", type=float, help="Brightness of the keyboard from 0 to 1")
+    parser.add_argument("--gamma", type=float, help="Gamma correction of the colors, > 1 darkens mid tones")
+    parser.add_argument("--export-status", help="Export mode, scheme and pressed keys for status bars, see --status",
+                        action="store_true")
+    parser.add_argument("--status-file", metavar="FILE",
+                        help="File of the exported status, implies --export-status when running "
+                             "(default: $XDG_RUNTIME_DIR/i3razer.status)")
+    parser.add_argument("--status", help="Print the status of the running i3razer and exit", action="store_true")
+    parser.add_argument("--wait-status", metavar="SEQ", nargs="?", type=int, const=-1,
+                        help="Wait until the status seq differs from SEQ (default: the current one), print it and exit")
+    parser.add_argument("--usage-file", metavar="FILE", nargs="?", const="",
+                        help="Count key presses for heatmap color schemes and save them in FILE "
+                             "(default: $XDG_STATE_HOME/i3razer/usage.json)")
+    parser.add_argument("--pause-locked", help="Pause handling keys and drawing while the screen is locked",
+                        action="store_true")
+    parser.add_argument("--lock-command", metavar="COMMAND",
+                        help="Shell command exiting with 0 while the screen is locked, e.g. 'pgrep -x i3lock', "
+                             "implies --pause-locked (the X screen saver state is used in any case)")
+    parser.add_argument("--lock-scheme", metavar="SCHEME",
+                        help="Color scheme shown while the screen is locked, 'off' turns the lights off, "
+                             "implies --pause-locked")
+    parser.add_argument("--build-frames", help="Write the frame bank of the config, which is memory mapped on start "
+                                               "instead of rendering the color schemes, and exit",
+                        action="store_true")
+    parser.add_argument("--frames-size", metavar="ROWSxCOLS",
+                        help="Keyboard size of the frame bank, e.g. 6x22 (default: the keyboards of the state file)")
+    parser.add_argument("--state-file", metavar="FILE",
+                        help="File to remember the state over restarts (default: $XDG_STATE_HOME/i3razer/state.json)")
+    parser.add_argument("--profile-file", metavar="FILE",
+                        help="Where to write the profile collected between two SIGUSR2 signals")
     parser.add_argument("-v", help="Be more verbose", action="count", default=0)
 
     args = parser.parse_args()
@@ -38,6 +96,30 @@ def main():
         print(f"open razer version: {openrazer_version}")
         exit()
 
+    # control a running instance
+    if args.send:
+        try:
+            answer = send_command(args.send, args.control_socket)
+        except OSError as e:
+            print(f"i3razer not reachable: {e}")
+            exit(1)
+        print(answer)
+        exit(0 if answer.startswith("ok") else 1)
+
+    # status for status bars
+    if args.status or args.wait_status is not None:
+        try:
+            status = read_status(args.status_file)
+            if args.wait_status is not None:
+                seq = status["seq"] if args.wait_status < 0 else args.wait_status
+                status = wait_for_change(seq, args.status_file)
+        except (OSError, ValueError) as e:
+            print(f"No status of i3razer: {e}")
+            exit(1)
+        print(f"seq {status['seq']}\nmode {status['mode']}\nscheme {status['scheme']}\n"
+              f"pressed {'+'.join(status['pressed'])}")
+        exit()
+
     # map a new layout
     if args.map:
         map_layout()
@@ -54,9 +136,38 @@ def main():
         level = logging.ERROR
     logging.basicConfig(format="%(message)s", level=level)
 
+    # prerender the frames
+    if args.build_frames:
+        exit(0 if build_frame_banks(args.config, args.layout, args.frames_size, args.state_file) else 1)
+
+    # SIGUSR1 dumps stats, SIGUSR2 toggles the profiler
+    install_signal_handlers(args.profile_file)
+
     # start
-    i3razer = I3Razer(config_file=args.config, layout=args.layout)
-    i3razer.start()
+    i3razer = I3Razer(config_file=args.config, layout=args.layout, i3_ipc=args.i3_ipc,
+                      state_file=args.state_file, watch_config=args.watch and not args.replay,
+                      control_socket=False if args.replay else args.control_socket or args.control,
+                      fps=args.fps, fade=args.fade, brightness=args.brightness, gamma=args.gamma,
+                      status_file=False if args.replay else args.status_file or args.export_status,
+                      usage_file=False if args.usage_file is None else args.usage_file or True,
+                      watch_lock=bool(args.pause_locked or args.lock_command or args.lock_scheme) and not args.replay,
+                      lock_command=args.lock_command,
+                      lock_scheme=args.lock_scheme and args.lock_scheme.lower())
+    # stop cleanly on SIGTERM and Ctrl-C, e.g. to close the record file and save the state
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: i3razer.stop())
+    if args.replay:
+        hook = ReplayHook(args.replay, realtime=not args.replay_fast)
+        i3razer.start(hook)
+        hook.join()
+        i3razer.stop()
+        print(f"Replayed {hook.events_replayed} events in {hook.duration:.3f}s")
+    elif args.evdev is not None:
+        i3razer.start(EvdevHook(args.evdev or None, record_file=args.record))
+    elif args.record:
+        i3razer.start(HookManager(record_file=args.record))
+    else:
+        i3razer.start()
 
 
 if __name__ == "__main__":
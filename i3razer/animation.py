@@ -0,0 +1,194 @@
+"""
+Software animations drawn on the animation layer of the compositor.
+Animations are precomputed as a list of steps when they are created, each step holds the colors of its cells
+(cell -> color bytes). The Animator shows the step belonging to the current time, so steps are skipped
+and not queued if drawing is slower than the frame rate.
+"""
+import math
+import threading
+import time
+from logging import getLogger
+
+from i3razer.stats import stats
+
+
+def _mix(color1, color2, ratio) -> bytes:
+    """
+    returns the color between color1 (ratio 0) and color2 (ratio 1)
+    """
+    return bytes(round(a + (b - a) * ratio) for a, b in zip(color1, color2))
+
+
+class Animation:
+    """
+    steps: list of cell -> color bytes, one for each frame
+    loop: True -> the steps are repeated until the animation is stopped or its duration is over
+    duration: seconds after which a looping animation ends, None for endless
+    """
+    steps = ()
+    loop = False
+    duration = None
+
+
+class Fade(Animation):
+    """
+    Fades the cells from the colors of one frame to the colors of another one
+    """
+
+    def __init__(self, from_frame, to_frame, cells, seconds, fps):
+        count = max(1, round(seconds * fps))
+        self.steps = []
+        for step in range(count):
+            ratio = step / count
+            self.steps.append({cell: _mix(from_frame[cell * 3:cell * 3 + 3], to_frame[cell * 3:cell * 3 + 3], ratio)
+                               for cell in cells})
+
+
+class Pulse(Animation):
+    """
+    Lets the cells glow up in the color and fade out again, once per period
+    """
+
+    def __init__(self, cells, color, period, fps, duration=None):
+        count = max(2, round(period * fps))
+        black = bytes(3)
+        self.loop = True
+        self.duration = duration
+        self.steps = []
+        for step in range(count):
+            color_step = _mix(black, color, (1 - math.cos(2 * math.pi * step / count)) / 2)
+            self.steps.append(dict.fromkeys(cells, color_step))
+
+
+class Gradient(Animation):
+    """
+    A gradient from color1 to color2 and back, moving from the left to the right over the cells once per period
+    """
+
+    def __init__(self, cells, cols, color1, color2, period, fps, duration=None):
+        count = max(2, round(period * fps))
+        columns = [cell % cols for cell in cells]
+        width = max(columns) - min(columns) + 1 if columns else 1
+        left = min(columns) if columns else 0
+        self.loop = True
+        self.duration = duration
+        self.steps = []
+        for step in range(count):
+            self.steps.append({cell: _mix(color1, color2, (1 - math.cos(
+                2 * math.pi * ((column - left) / width - step / count))) / 2) for cell, column in zip(cells, columns)})
+
+
+class Animator(threading.Thread):
+    """
+    Scheduler showing the running animations with a fixed frame rate.
+    OnFrame is called with the cells of all running animations (later started ones above earlier ones),
+    once with no cells after the last animation ended. The thread sleeps while no animation runs.
+    If a frame takes longer than 1 / fps, the following frames are dropped and counted.
+    Frame times are collected as 'animation.frame' samples in the stats.
+
+    OnFrame     : called with cell -> color bytes
+    """
+
+    def __init__(self, fps=30, logger=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.name = "i3razer-animator"
+        if not logger:
+            logger = getLogger(__name__)
+        self._logger = logger
+        self.fps = fps
+        self.finished = threading.Event()
+        self.OnFrame = lambda cells: True
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._animations = {}  # id -> (animation, start time)
+        self._next_id = 1
+        self._paused = False
+
+    def add(self, animation, animation_id=None) -> int:
+        """
+        starts the animation, an animation with the same id is replaced
+        return: id of the animation
+        """
+        with self._lock:
+            if animation_id is None:
+                animation_id = self._next_id
+                self._next_id += 1
+            self._animations.pop(animation_id, None)
+            self._animations[animation_id] = (animation, time.monotonic())
+        self._wake.set()
+        return animation_id
+
+    def remove(self, animation_id=None) -> bool:
+        """
+        stops the animation, all if no id is given
+        return: False if there is no such animation
+        """
+        with self._lock:
+            if animation_id is None:
+                self._animations.clear()
+            elif self._animations.pop(animation_id, None) is None:
+                return False
+        self._wake.set()
+        return True
+
+    def set_paused(self, paused):
+        """
+        paused: True -> no frames are shown, the animations go on in time
+        """
+        self._paused = paused
+        self._wake.set()
+
+    def current_cells(self, now=None) -> dict:
+        """
+        returns the cells of all running animations at the time, ended animations are removed
+        """
+        if now is None:
+            now = time.monotonic()
+        cells = {}
+        with self._lock:
+            for animation_id, (animation, started) in list(self._animations.items()):
+                elapsed = now - started
+                step = int(elapsed * self.fps)
+                if animation.loop:
+                    if animation.duration is not None and elapsed >= animation.duration:
+                        del self._animations[animation_id]
+                        continue
+                    step %= len(animation.steps)
+                elif step >= len(animation.steps):
+                    del self._animations[animation_id]
+                    continue
+                cells.update(animation.steps[step])
+        return cells
+
+    def run(self):
+        interval = 1 / self.fps
+        next_frame = time.monotonic()
+        shown = False  # the last frame had cells, they need to be cleared once no animation runs
+        while not self.finished.is_set():
+            if self._paused or (not self._animations and not shown):
+                self._wake.wait()
+                self._wake.clear()
+                next_frame = time.monotonic()
+                continue
+            now = time.monotonic()
+            if now < next_frame:
+                self._wake.wait(next_frame - now)
+                self._wake.clear()
+                continue
+            late = int((now - next_frame) / interval)
+            if late:
+                stats.count("animation_frames_dropped", late)
+            next_frame += (late + 1) * interval
+
+            start = time.perf_counter()
+            cells = self.current_cells(now)
+            self.OnFrame(cells)
+            shown = bool(cells)
+            stats.add_sample("animation.frame", time.perf_counter() - start)
+            stats.count("animation_frames")
+
+    def cancel(self):
+        self.finished.set()
+        self._wake.set()
@@ -0,0 +1,68 @@
+"""
+Color correction of the frames sent to the keyboard: brightness, gamma and white balance
+"""
+
+
+class ColorPipeline:
+    """
+    Precomputes a lookup table with 256 entries for each channel, so correcting a frame is one bytes.translate
+    per channel. A pipeline is immutable, changing a setting creates a new one.
+
+    brightness: 0 (off) to 1 (full)
+    gamma: exponent applied to the normalized channel value, > 1 darkens the mid tones
+    white_balance: factor of red, green and blue, e.g. (1, 0.8, 0.7) if white looks bluish
+    """
+    __slots__ = ("brightness", "gamma", "white_balance", "luts", "identity")
+
+    def __init__(self, brightness=1.0, gamma=1.0, white_balance=(1.0, 1.0, 1.0)):
+        brightness = min(1.0, max(0.0, float(brightness)))
+        gamma = float(gamma)
+        if gamma <= 0:
+            raise ValueError(f"gamma must be positive, not {gamma}")
+        white_balance = tuple(min(1.0, max(0.0, float(factor))) for factor in white_balance)
+        if len(white_balance) != 3:
+            raise ValueError("white balance needs a factor for red, green and blue")
+        luts = tuple(bytes(round(255 * brightness * factor * (value / 255) ** gamma) for value in range(256))
+                     for factor in white_balance)
+        set_ = object.__setattr__
+        set_(self, "brightness", brightness)
+        set_(self, "gamma", gamma)
+        set_(self, "white_balance", white_balance)
+        set_(self, "luts", luts)
+        set_(self, "identity", all(lut == bytes(range(256)) for lut in luts))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("ColorPipeline is immutable")
+
+    def replace(self, brightness=None, gamma=None, white_balance=None):
+        """
+        returns a pipeline with the given settings changed
+        """
+        return ColorPipeline(self.brightness if brightness is None else brightness,
+                             self.gamma if gamma is None else gamma,
+                             self.white_balance if white_balance is None else white_balance)
+
+    def apply(self, frame):
+        """
+        returns the corrected frame, the frame itself if nothing is corrected
+        """
+        if self.identity:
+            return frame
+        if isinstance(frame, memoryview):
+            # frame of a frame bank
+            frame = frame.tobytes()
+        corrected = bytearray(len(frame))
+        for channel in range(3):
+            corrected[channel::3] = frame[channel::3].translate(self.luts[channel])
+        return corrected
+
+    def apply_color(self, color):
+        """
+        returns the corrected (r, g, b)
+        """
+        if self.identity:
+            return color
+        return tuple(lut[value] for lut, value in zip(self.luts, color))
+
+    def settings(self) -> dict:
+        return {"brightness": self.brightness, "gamma": self.gamma, "white_balance": list(self.white_balance)}
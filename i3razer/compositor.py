@@ -0,0 +1,128 @@
+"""
+Composes the frame shown on the keyboard from layers.
+The base layer is a whole frame, the layers above only color some cells (their mask), the other cells show
+the layers below. Cells are numbered row major: cell = row * cols + col
+"""
+from i3razer.frame import new_frame
+from i3razer.stats import stats
+
+LAYER_BASE = 0  # default scheme of the mode
+LAYER_SCHEME = 1  # scheme selected by pressed keys, as difference to the base
+LAYER_ANIMATION = 2  # software animations
+LAYER_OVERLAY = 3  # transient overlays and highlighted keys (control command overlay)
+LAYERS = ("base", "scheme", "animation", "overlay")
+
+
+class Compositor:
+    """
+    Keeps the composite of each layer with all layers below it. Changing a layer recomputes only the cells it
+    touches in its own and the higher composites, so the work is proportional to the changed cells.
+    All changing methods return the cells which changed in the composed frame.
+    """
+
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self._base = None  # frame of the base layer
+        self._cells = [dict() for _ in LAYERS[1:]]  # cell -> color bytes for each layer above the base
+        self._composites = [new_frame(rows, cols) for _ in LAYERS]
+
+    @property
+    def frame(self):
+        """
+        the composed frame of all layers
+        """
+        return self._composites[-1]
+
+    def get_composite(self, layer):
+        """
+        returns the frame composed of the layer and all layers below it
+        """
+        return self._composites[layer]
+
+    def set_base(self, frame) -> set:
+        """
+        replaces the base layer with a whole frame
+        """
+        if frame is self._base:
+            return set()
+        old = self._base
+        self._base = frame
+        if old is None:
+            dirty = range(self.rows * self.cols)
+        else:
+            dirty = [cell for cell in range(self.rows * self.cols)
+                     if frame[cell * 3:cell * 3 + 3] != old[cell * 3:cell * 3 + 3]]
+        return self._recompose(LAYER_BASE, dirty)
+
+    def set_layer(self, layer, cells) -> set:
+        """
+        replaces all cells of the layer, cells: cell -> color bytes
+        """
+        old = self._cells[layer - 1]
+        if old is cells:
+            return set()
+        self._cells[layer - 1] = cells
+        dirty = set(old)
+        dirty.update(cells)
+        return self._recompose(layer, dirty)
+
+    def update_layer(self, layer, cells=None, remove=()) -> set:
+        """
+        sets the given cells of the layer and removes the cells in remove from its mask
+        """
+        layer_cells = self._cells[layer - 1] = dict(self._cells[layer - 1])
+        dirty = set()
+        for cell in remove:
+            if layer_cells.pop(cell, None) is not None:
+                dirty.add(cell)
+        if cells:
+            layer_cells.update(cells)
+            dirty.update(cells)
+        return self._recompose(layer, dirty)
+
+    def copy(self):
+        """
+        returns an independent compositor with the same layers, e.g. to keep the shown frame for later
+        """
+        compositor = Compositor.__new__(Compositor)
+        compositor.rows = self.rows
+        compositor.cols = self.cols
+        compositor._base = self._base
+        compositor._cells = list(self._cells)  # layer dicts are replaced or copied before they change
+        compositor._composites = [bytearray(composite) for composite in self._composites]
+        return compositor
+
+    @property
+    def nbytes(self):
+        """
+        bytes held by the composed frames
+        """
+        return sum(len(composite) for composite in self._composites)
+
+    def get_layer(self, layer):
+        """
+        returns the cells of a layer above the base
+        """
+        return self._cells[layer - 1]
+
+    def _recompose(self, layer, dirty) -> set:
+        """
+        recomputes the dirty cells in the composites of the layer and all above
+        """
+        composites = self._composites
+        base = self._base
+        top = composites[-1]
+        changed = set()
+        for cell in dirty:
+            index = cell * 3
+            old = top[index:index + 3]
+            color = composites[layer - 1][index:index + 3] if layer else base[index:index + 3]
+            for above in range(layer, len(LAYERS)):
+                if above:
+                    color = self._cells[above - 1].get(cell, color)
+                composites[above][index:index + 3] = color
+            if color != old:
+                changed.add(cell)
+        stats.count("composed_cells", len(dirty))
+        return changed
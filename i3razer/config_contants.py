@@ -5,6 +5,7 @@ sec_color = "colors"
 sec_keys = "keys"
 sec_modes = "modes"
 sec_color_schemes = "color_schemes"
+sec_include = "include"  # files which are read before this file, this file overrides their entries
 
 mode_default = "default"  # start mode
 scheme_default = "scheme"  # default color scheme in mode
@@ -14,7 +15,11 @@ all_keys = "all"
 field_type = "type"
 field_inherit = "inherit"
 field_switch = "switch_mode"
+field_push = "push_mode"  # like switch_mode, but the current mode is remembered to return to it with pop_mode
+field_pop = "pop_mode"  # keys which return to the mode the current mode was pushed from
 field_name = "name"  # saves name of schemes or modes
+field_i3_mode = "i3_mode"  # name of the i3 mode which activates this mode, defaults to the mode name
+field_mode = "mode"  # heatmap: mode whose key presses are shown, all modes if not set
 
 # delimiter
 del_array = ","
@@ -34,6 +39,8 @@ type_starlight = "starlight"  # up to dual
 type_wave_right = "wave right"  # direction
 type_wave_left = "wave left"  # direction
 
+type_heatmap = "heatmap"  # key presses, up to three colors for the ramp from unused to most used
+
 # type options
 type_color = "color"  # if set color2,3 are ignored
 type_color1 = "color1"
@@ -56,10 +63,12 @@ time_2000 = "2000"  # doesn't seem to work
 time_r_default = time_1000
 
 # variable combinations
-no_color_scheme_in_mode = {field_inherit, field_switch, field_name}  # fields which value is no color scheme in modes
+no_color_scheme_in_mode = {field_inherit, field_switch, field_push, field_pop, field_name,
+                           field_i3_mode}  # fields which value is no color scheme in modes
 possible_types = {type_static, type_breath, type_reactive, type_ripple, type_spectrum, type_starlight, type_wave_right,
-                  type_wave_left}  # all types
-no_color_in_scheme = {type_option_time, field_inherit, field_type, field_name}  # fields which value is no color
+                  type_wave_left, type_heatmap}  # all types
+no_color_in_scheme = {type_option_time, field_inherit, field_type, field_name,
+                      field_mode}  # fields which value is no color
 
 needs_color = {type_reactive}  # types where at least one color must be specified
 
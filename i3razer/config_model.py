@@ -0,0 +1,163 @@
+"""
+Compiled, immutable objects of the config, emitted by the ConfigParser after reading.
+They hold everything needed at runtime, so no string keyed lookups are done while handling key events.
+"""
+from i3razer import config_contants as conf
+from i3razer.heatmap import color_ramp
+
+
+class _Frozen:
+    """
+    Base for the immutable model objects, attributes are set once with _init
+    """
+    __slots__ = ()
+
+    def _init(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+class Color(_Frozen):
+    """
+    A rgb color, iterating gives r, g, b
+    """
+    __slots__ = ("r", "g", "b")
+
+    def __init__(self, r, g, b):
+        self._init(r=r, g=g, b=b)
+
+    def __iter__(self):
+        return iter((self.r, self.g, self.b))
+
+    def __eq__(self, other):
+        return isinstance(other, Color) and tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash((self.r, self.g, self.b))
+
+
+class Binding(_Frozen):
+    """
+    Key combinations which select a target (a color scheme or a mode)
+    combinations: tuple of (keys, exact), exact -> JUST these keys are pressed ('nothing + ...')
+    keys: all keys in the combinations
+    """
+    __slots__ = ("combinations", "target", "keys")
+
+    def __init__(self, combinations, target):
+        keys = frozenset(key for combination, _ in combinations for key in combination)
+        self._init(combinations=tuple(combinations), target=target, keys=keys)
+
+    def matches(self, pressed_keys) -> bool:
+        for combination, exact in self.combinations:
+            if exact:
+                if pressed_keys == combination:
+                    return True
+            elif combination <= pressed_keys:
+                return True
+        return False
+
+
+def _inherit(own, inherited):
+    """
+    returns the own entries before the inherited ones, the inherited tuple itself if there are no own entries
+    """
+    return tuple(own) + inherited if own else inherited
+
+
+def _inherit_keys(own, inherited):
+    """
+    returns the union of the key sets, the inherited set itself if it has all own keys
+    """
+    return inherited if own <= inherited else inherited | own
+
+
+class Mode(_Frozen):
+    """
+    scheme: name of the color scheme shown if no binding matches
+    bindings: Bindings to color schemes, the first matching one is used
+    switches: Bindings to modes
+    pushes: Bindings to modes, which are entered on top of the mode stack
+    pop: Binding without target returning to the mode below on the mode stack, or None
+    scheme_keys, switch_keys: keys used in bindings / switches, pushes and pop
+    keys: all keys used by the mode
+    i3_mode: name of the i3 mode which activates this mode
+
+    A mode with a base mode is flattened: its own bindings come first, followed by the ones of the base mode.
+    Tuples and key sets which the mode does not extend are the ones of the base mode, not copies
+    """
+    __slots__ = ("name", "scheme", "bindings", "switches", "pushes", "pop", "scheme_keys", "switch_keys", "keys",
+                 "i3_mode")
+
+    def __init__(self, name, scheme, bindings, switches, i3_mode, pushes=(), pop=None, base=None):
+        """
+        base: the compiled Mode to inherit from, or None
+        """
+        scheme_keys = frozenset(key for binding in bindings for key in binding.keys)
+        switch_keys = frozenset(key for binding in list(switches) + list(pushes) + ([pop] if pop else [])
+                                for key in binding.keys)
+        if base:
+            scheme = scheme or base.scheme
+            bindings = _inherit(bindings, base.bindings)
+            switches = _inherit(switches, base.switches)
+            pushes = _inherit(pushes, base.pushes)
+            pop = pop or base.pop
+            scheme_keys = _inherit_keys(scheme_keys, base.scheme_keys)
+            switch_keys = _inherit_keys(switch_keys, base.switch_keys)
+            keys = _inherit_keys(scheme_keys | switch_keys, base.keys)
+        else:
+            keys = scheme_keys | switch_keys
+        self._init(name=name, scheme=scheme, bindings=tuple(bindings), switches=tuple(switches),
+                   pushes=tuple(pushes), pop=pop, scheme_keys=scheme_keys, switch_keys=switch_keys, keys=keys,
+                   i3_mode=i3_mode)
+
+
+class StaticScheme(_Frozen):
+    """
+    A color scheme which assigns colors to keys
+    assignments: tuple of (keys, Color), keys is None for all keys of the layout. Later assignments override
+    inherit: name of the inherited scheme or None
+    inherit_index: the inherited scheme is applied before assignments[inherit_index:]
+    """
+    __slots__ = ("name", "inherit", "inherit_index", "assignments")
+    type = conf.type_static
+
+    def __init__(self, name, assignments, inherit=None, inherit_index=0):
+        self._init(name=name, inherit=inherit, inherit_index=inherit_index, assignments=tuple(assignments))
+
+
+class EffectScheme(_Frozen):
+    """
+    A color scheme showing a built in effect of the keyboard
+    colors: tuple of up to three Colors
+    time: time option of the effect or None
+    """
+    __slots__ = ("name", "type", "colors", "time")
+
+    def __init__(self, name, effect_type, colors, time=None):
+        self._init(name=name, type=effect_type, colors=tuple(colors), time=time)
+
+
+class HeatmapScheme(_Frozen):
+    """
+    A color scheme showing how often each key was pressed
+    colors: tuple of up to three Colors, from unused to most used keys
+    mode: name of the mode whose presses are shown, None for all modes
+    ramp: 256 precomputed colors (bytes) between the colors
+    """
+    __slots__ = ("name", "colors", "mode", "ramp")
+    type = conf.type_heatmap
+
+    def __init__(self, name, colors, mode=None):
+        colors = tuple(colors) or (Color(0, 0, 255), Color(255, 0, 0))
+        self._init(name=name, colors=colors, mode=mode, ramp=tuple(color_ramp(colors)))
@@ -1,25 +1,53 @@
+import os
+import threading
+from hashlib import sha1
 from logging import ERROR, getLogger
 from re import split as re_split
 
 import i3razer.config_contants as conf
+from i3razer.config_model import Binding, Color, EffectScheme, HeatmapScheme, Mode, StaticScheme
+from i3razer.stats import stats
 from yaml import YAMLError as YamlError, safe_load as yaml_load
 
+# content hash of a config file: (configuration in lower case, included files, errors of the file)
+# shared by all ConfigParsers, so a reload parses only the changed files
+_parsed_files = {}
+_PARSED_FILES_MAX = 64
+_sections = (conf.sec_color, conf.sec_keys, conf.sec_color_schemes, conf.sec_modes)
+
 
 class ConfigParser:
     _config_file = ""
+    _files = []  # files the config is read from, each once, in the order they are read
     _logger = None
     _conf_log_level = ERROR
 
     _configuration = dict()
     _config_integral = False  # result of the integral check after reading
 
-    def __init__(self, config_file, logger=None):
+    # compiled config, see config_model
+    # only modes and schemes reachable from the default mode are compiled on reading, others on request.
+    # Requests come from several threads: they compile under _compile_lock and replace the dicts with extended
+    # copies, so a thread iterating the dicts of get_modes() / get_color_schemes() never sees them change
+    _modes = dict()
+    _schemes = dict()
+    _compile_lock = None
+    _colors = dict()  # color name or code: Color
+    _unreachable_modes = []
+    _unreachable_schemes = []
+    _all_modes_reachable = False
+
+    def __init__(self, config_file, logger=None, all_modes_reachable=False):
         """
         Inits the logger and the reads the config file
+        all_modes_reachable: every mode can be entered, not only the ones reachable with switch_mode from default.
+            e.g. if the modes are switched by i3
         """
         if not logger:
             logger = getLogger(__name__)
         self._logger = logger
+        self._all_modes_reachable = all_modes_reachable
+        self._compile_lock = threading.RLock()  # reentrant, compiling a mode compiles its base mode
         self.read(config_file)
 
     def is_integral(self):
@@ -39,31 +67,148 @@ class ConfigParser:
             config_file = self._config_file
         self._config_file = config_file
 
-        # read file
-        try:
-            with open(config_file, 'r') as file:
-                try:
-                    self._configuration = yaml_load(file)
-                except YamlError as e:
-                    self._logger.error(f"Yaml Error: {e}")
-                    return False
-        except FileNotFoundError:
-            self._logger.error(f"Config file '{config_file}' not found")
+        # read file and included files
+        self._files = []
+        configuration = self._read_file(os.path.abspath(config_file), [])
+        if configuration is None:
             return False
+        self._configuration = configuration
 
-        # process
-        self._to_lower_case()
-        if not self._check_integrity():
+        # process, the phases are timed in the stats (see benchmarks/config_benchmark.py)
+        with stats.timed("config.check_integrity"):
+            integral = self._check_integrity()
+        if not integral:
             return False
-        self._add_fields()
+        with stats.timed("config.add_fields"):
+            self._add_fields()
+        self._colors = {}
+        with stats.timed("config.compile"):
+            self._compile()
         return True
 
-    def _to_lower_case(self):
+    def _read_file(self, path, including):
+        """
+        reads the file and the files it includes, the entries of a file override the ones of its included files
+        including: the files including this file, to detect include loops
+        return: the merged configuration, None on errors
+        """
+        if path in including:
+            self._logger.error(f"Include loop: {' -> '.join(including + [path])}")
+            return None
+        if path not in self._files:
+            # a file included on several paths is watched once
+            self._files.append(path)
+        parsed = self._parse_file(path)
+        if parsed is None:
+            return None
+        configuration, includes, errors = parsed
+        for error in errors:
+            self._logger.log(self._conf_log_level, f"{error} (in '{path}')")
+        if errors:
+            return None
+
+        merged = {}
+        for include in includes:
+            include = os.path.normpath(os.path.join(os.path.dirname(path), os.path.expanduser(include)))
+            included = self._read_file(include, including + [path])
+            if included is None:
+                return None
+            with stats.timed("config.merge"):
+                self._merge(merged, included)
+        with stats.timed("config.merge"):
+            self._merge(merged, configuration)
+        return merged
+
+    def _parse_file(self, path):
+        """
+        parses and checks a single file, the result is cached by the content of the file
+        return: (configuration, included files, errors), None if the file cannot be parsed
         """
-        sets all end values in the config to lower case and converts them to strings
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            self._logger.error(f"Config file '{path}' not found")
+            return None
+        digest = sha1(data).digest()
+        parsed = _parsed_files.get(digest)
+        stats.cache("config_files", parsed is not None)
+        if parsed is not None:
+            return parsed
+
+        try:
+            with stats.timed("config.yaml_load"):
+                raw = yaml_load(data)
+        except YamlError as e:
+            self._logger.error(f"Yaml Error: {e}")
+            return None
+        if raw is None:
+            raw = {}
+        if not isinstance(raw, dict):
+            self._logger.error(f"Config file '{path}' is no dictionary")
+            return None
+        # section names are case insensitive like the other sections, file names are not changed to lower case
+        includes = None
+        for section in [section for section in raw if str(section).lower() == conf.sec_include]:
+            includes = raw.pop(section)
+        includes = includes or []
+        if isinstance(includes, str):
+            includes = [includes]
+        errors = []
+        if not isinstance(includes, list) or not all(isinstance(include, str) for include in includes):
+            errors.append(f"'{conf.sec_include}' must be a file name or a list of file names")
+            includes = []
+        with stats.timed("config.lower_case"):
+            configuration = self._lower_case_helper(raw)
+        with stats.timed("config.check_file"):
+            errors.extend(self._check_file(configuration))
+
+        parsed = (configuration, tuple(includes), tuple(errors))
+        if len(_parsed_files) >= _PARSED_FILES_MAX:
+            # forget the oldest file
+            del _parsed_files[next(iter(_parsed_files))]
+        _parsed_files[digest] = parsed
+        return parsed
+
+    @staticmethod
+    def _check_file(configuration):
+        """
+        checks what can be checked in a single file, references between files are checked after merging
+        return: list of errors
+        """
+        errors = []
+        for section in _sections:
+            entries = configuration.get(section)
+            if entries is not None and not isinstance(entries, dict):
+                errors.append(f"Section '{section}' is no dictionary")
+        colors = configuration.get(conf.sec_color)
+        if isinstance(colors, dict):
+            for color_name, color in colors.items():
+                if not isinstance(color, str) or not color.startswith("0x"):
+                    errors.append(f"Invalid color definition: {color_name}: {color}")
+        return errors
+
+    @staticmethod
+    def _merge(merged, configuration):
+        """
+        adds the entries of the configuration to merged, entries with the same name are replaced as a whole.
+        The entries are copied, as the cached configuration must not change
+        """
+        for section, entries in configuration.items():
+            if isinstance(entries, dict):
+                merged_entries = merged.get(section)
+                if not isinstance(merged_entries, dict):
+                    merged_entries = merged[section] = {}
+                for name, entry in entries.items():
+                    merged_entries[name] = dict(entry) if isinstance(entry, dict) else entry
+            else:
+                merged[section] = entries
+
+    def get_files(self):
+        """
+        returns the files the config is read from
         """
-        self._configuration = self._lower_case_helper(self._configuration)
-        pass
+        return list(self._files)
 
     def _lower_case_helper(self, value):
         """
@@ -104,25 +249,37 @@ class ConfigParser:
             if conf.mode_default not in modes:
                 self._logger.log(self._conf_log_level, f"No Default mode '{conf.mode_default}' in modes section")
                 res = False
+            inherit = {}
             for mode_name in modes:
                 # check each mode for correct definition
                 mode = modes[mode_name]
-                if conf.scheme_default not in mode:
+                if conf.field_inherit in mode:
+                    inherit[mode_name] = {mode[conf.field_inherit]}
+                    is_mode[mode[conf.field_inherit]] = f"Inherit in mode {mode_name}"
+                elif conf.scheme_default not in mode:
                     self._logger.log(self._conf_log_level,
                                      f"Mode {mode_name} has no default color scheme (Field: {conf.scheme_default})")
                     res = False
                 for field in mode:
                     # check the fields of the mode
-                    if field == conf.field_switch:
+                    if field in (conf.field_switch, conf.field_push):
+                        if not isinstance(mode[field], dict):
+                            self._logger.log(self._conf_log_level, f"'{field}' in mode {mode_name} is no dictionary")
+                            res = False
+                            continue
                         for switch in mode[field]:
                             # field name is not checked as this can be key sets, arrays, combinations or single keys
                             # single key names are not known, so invalid key cannot be detected
-                            is_mode[mode[field][switch]] = f"switch mode with {switch} in mode {mode_name}"
+                            is_mode[mode[field][switch]] = f"{field} with {switch} in mode {mode_name}"
+                    elif field == conf.field_pop and not isinstance(mode[field], str):
+                        self._logger.log(self._conf_log_level, f"'{field}' in mode {mode_name} is no key array")
+                        res = False
 
                     if field in conf.no_color_scheme_in_mode:
                         continue
                     # every other field has a color scheme as value
                     is_scheme[mode[field]] = f"'{field}' in Mode {mode_name}"
+            inheriting["modes"] = inherit
 
         # check color schemes section
         if conf.sec_color_schemes not in c:
@@ -166,6 +323,8 @@ class ConfigParser:
                             res = False
                 for field in scheme:
                     # check each field
+                    if field == conf.field_mode:
+                        is_mode[scheme[field]] = f"heatmap scheme {scheme_name}"
                     if field == conf.field_inherit:
                         inherit[scheme_name] = {scheme[field]}
                         is_scheme[scheme[field]] = f"Inherit in scheme {scheme_name}"
@@ -297,16 +456,14 @@ class ConfigParser:
         razer_color = ((color_code // 256 // 256) % 256, (color_code // 256) % 256, color_code % 256)
         return razer_color
 
-    # avoiding infinite loops
-    _checking_keysets = set()
-
-    def get_keys(self, name):
+    def get_keys(self, name, checking_keysets=frozenset()):
         """
         decodes all keys from a given name, splits arrays and follows key set definitons
+        checking_keysets: key sets which are being resolved, avoiding infinite loops
         """
         keys = self._get_keys_single(name)
-        keys = keys.union(self._get_keys_array(name))
-        return keys.union(self._get_keys_referenced(name))
+        keys = keys.union(self._get_keys_array(name, checking_keysets))
+        return keys.union(self._get_keys_referenced(name, checking_keysets))
 
     def _get_keys_single(self, name):
         """
@@ -316,7 +473,7 @@ class ConfigParser:
             return set()
         return {name}
 
-    def _get_keys_array(self, array):
+    def _get_keys_array(self, array, checking_keysets):
         """
         if array is a key array, this returns the all keys in the keyarray, also the referenced one in the key section
         """
@@ -330,10 +487,10 @@ class ConfigParser:
         # arrays gets shorter so not stackoverflow possible
         resolved_keys = set()
         for key in keys:
-            resolved_keys = resolved_keys.union(self.get_keys(key))
+            resolved_keys = resolved_keys.union(self.get_keys(key, checking_keysets))
         return resolved_keys
 
-    def _get_keys_referenced(self, reference):
+    def _get_keys_referenced(self, reference, checking_keysets):
         """
         resolves a reference name (defined in section keys) to its corresponding keys
         Also done recursively by calling get_keys
@@ -343,94 +500,276 @@ class ConfigParser:
             return
         keys = set()
         if reference in self._configuration[conf.sec_keys]:
-            if reference in self._checking_keysets:
+            if reference in checking_keysets:
                 # reference loop detected
                 self._logger.warning(f"Keys {reference} occur in an infinite loop")
                 return keys
-            self._checking_keysets.add(reference)
-            keys = self.get_keys(self._configuration[conf.sec_keys][reference])
-            self._checking_keysets.remove(reference)
+            keys = self.get_keys(self._configuration[conf.sec_keys][reference], checking_keysets | {reference})
         return keys
 
-    def _get_combination_value(self, pressed_keys, options):
+    def get_key_references(self) -> dict:
         """
-        selects the correct option for the pressed keys
+        returns each key name used in the reachable modes and static color schemes -> set of where it is used,
+        e.g. "mode 'default'". Key sets are resolved and combinations are split into their keys.
+        Like compiling, unreachable modes and schemes are left out
         """
-        # keys can be defined as arrays or keylists as 'or' pressed keys.
-        # if the list is 'key1 + key2' both keys must be pressed ('and')
-        # special: 'nothing + key1 + key2' only holds if JUST key1 and key2 are pressed
-        # precedence is from top to bottom, so on extra handling
-        for option_keys in options:
-            keys = self.get_keys(option_keys)
-            for key_comb in keys:
-                combination = {k.strip() for k in key_comb.split(conf.del_combination)}
-                if conf.comb_nothing in combination:
-                    # special case, JUST set keys should be pressed
-                    combination.remove(conf.comb_nothing)
-                    if pressed_keys == combination:
-                        return options[option_keys]
-                else:
-                    if combination <= pressed_keys:
-                        return options[option_keys]
-        # if no combination matched None is returned
-
-    def get_important_keys_mode(self, mode):
+        references = {}
+        unreachable_modes, unreachable_schemes = set(self._unreachable_modes), set(self._unreachable_schemes)
+
+        def add(key_array, where):
+            for key_comb in self.get_keys(key_array):
+                for key in key_comb.split(conf.del_combination):
+                    key = key.strip()
+                    if key and key != conf.comb_nothing:
+                        references.setdefault(key, set()).add(where)
+
+        for name, mode in self._configuration[conf.sec_modes].items():
+            if name in unreachable_modes:
+                continue
+            for field, value in mode.items():
+                if field in (conf.field_switch, conf.field_push):
+                    for key_array in value:
+                        add(key_array, f"mode '{name}'")
+                elif field == conf.field_pop:
+                    add(value, f"mode '{name}'")
+                elif field not in conf.no_color_scheme_in_mode and field != conf.scheme_default:
+                    add(field, f"mode '{name}'")
+        for name, scheme in self._configuration[conf.sec_color_schemes].items():
+            if scheme[conf.field_type] != conf.type_static or name in unreachable_schemes:
+                continue
+            for field in scheme:
+                if field not in conf.no_color_in_scheme and field != conf.all_keys:
+                    add(field, f"color scheme '{name}'")
+        return references
+
+    def _compile(self):
+        """
+        compiles the reachable modes and color schemes into the immutable model objects used at runtime
+        """
+        modes = self._configuration[conf.sec_modes]
+        schemes = self._configuration[conf.sec_color_schemes]
+        reachable_modes, reachable_schemes = self._find_reachable()
+        self._modes = {}
+        for name in modes:
+            if name in reachable_modes and name not in self._modes:
+                # base modes are compiled before the modes inheriting from them
+                self._modes[name] = self._compile_mode(modes[name])
+        self._schemes = {name: self._compile_scheme(schemes[name]) for name in schemes if name in reachable_schemes}
+
+        self._unreachable_modes = [name for name in modes if name not in reachable_modes]
+        self._unreachable_schemes = [name for name in schemes if name not in reachable_schemes]
+        if self._unreachable_modes:
+            self._logger.info(f"Modes not reachable from mode '{conf.mode_default}': {self._unreachable_modes}")
+        if self._unreachable_schemes:
+            self._logger.info(f"Color schemes not used by reachable modes: {self._unreachable_schemes}")
+
+    def _find_reachable(self):
+        """
+        returns the names of the modes reachable from the default mode with switch_mode
+        and the names of the color schemes used by these modes (including inherited schemes)
+        Modes setting i3_mode explicitly can be entered by i3, they are reachable as well
+        """
+        modes = self._configuration[conf.sec_modes]
+        schemes = self._configuration[conf.sec_color_schemes]
+        if self._all_modes_reachable:
+            todo = list(modes)
+        else:
+            todo = [conf.mode_default] + [name for name in modes if conf.field_i3_mode in modes[name]]
+        reachable_modes = set()
+        scheme_todo = []
+        while todo:
+            name = todo.pop()
+            if name in reachable_modes or name not in modes:
+                continue
+            reachable_modes.add(name)
+            for field, value in modes[name].items():
+                if field in (conf.field_switch, conf.field_push):
+                    todo.extend(value.values())
+                elif field == conf.field_inherit:
+                    # the bindings of the base mode are part of the mode
+                    todo.append(value)
+                elif field not in conf.no_color_scheme_in_mode:
+                    scheme_todo.append(value)
+
+        reachable_schemes = set()
+        while scheme_todo:
+            name = scheme_todo.pop()
+            if name in reachable_schemes or name not in schemes:
+                continue
+            reachable_schemes.add(name)
+            if conf.field_inherit in schemes[name]:
+                scheme_todo.append(schemes[name][conf.field_inherit])
+        return reachable_modes, reachable_schemes
+
+    def get_unreachable(self):
         """
-        keys to listen to when in given mode
+        returns the names of the modes and color schemes, which are not reachable from the default mode
         """
-        keys = set()
+        return self._unreachable_modes, self._unreachable_schemes
+
+    def _compile_mode(self, mode):
+        bindings = []
+        switches = []
+        pushes = []
+        pop = None
         for field in mode:
             if field == conf.field_switch:
-                for switch_comb in mode[conf.field_switch]:
-                    keys = keys.union(self._get_all_keys(switch_comb))
+                switches = [self._compile_binding(keys, target) for keys, target in mode[field].items()]
+            elif field == conf.field_push:
+                pushes = [self._compile_binding(keys, target) for keys, target in mode[field].items()]
+            elif field == conf.field_pop:
+                pop = self._compile_binding(mode[field], None)
             elif field in conf.no_color_scheme_in_mode or field == conf.scheme_default:
                 continue
             else:
-                keys = keys.union(self._get_all_keys(field))
-        return keys
+                bindings.append(self._compile_binding(field, mode[field]))
+        name = mode[conf.field_name]
+        base = self.get_mode_by_name(mode[conf.field_inherit]) if conf.field_inherit in mode else None
+        return Mode(name, mode.get(conf.scheme_default), bindings, switches, mode.get(conf.field_i3_mode, name),
+                    pushes, pop, base)
 
-    def _get_all_keys(self, key_array):
+    def _compile_binding(self, key_array, target):
         """
-        return all the keys in an array, either referenced or in a combination
-        differs from get_keys, because it also splits combinations
+        splits the key array into its combinations
         """
-        keys = set()
-        key_combs = self.get_keys(key_array)
-        for comb in key_combs:
-            for key in comb.split(conf.del_combination):
-                keys.add(key.strip())
-        return keys
+        # keys can be defined as arrays or keylists as 'or' pressed keys.
+        # if the list is 'key1 + key2' both keys must be pressed ('and')
+        # special: 'nothing + key1 + key2' only holds if JUST key1 and key2 are pressed
+        combinations = []
+        for key_comb in self.get_keys(key_array):
+            combination = {k.strip() for k in key_comb.split(conf.del_combination)}
+            exact = conf.comb_nothing in combination
+            combination.discard(conf.comb_nothing)
+            combinations.append((frozenset(combination), exact))
+        return Binding(combinations, target)
+
+    def _compile_scheme(self, scheme):
+        name = scheme[conf.field_name]
+        if scheme[conf.field_type] != conf.type_static:
+            if conf.type_color in scheme:
+                color_fields = [conf.type_color]
+            else:
+                color_fields = []
+                for field in (conf.type_color1, conf.type_color2, conf.type_color3):
+                    if field not in scheme:
+                        break
+                    color_fields.append(field)
+            colors = [self._compile_color(scheme[field]) for field in color_fields]
+            if scheme[conf.field_type] == conf.type_heatmap:
+                return HeatmapScheme(name, colors, scheme.get(conf.field_mode))
+            return EffectScheme(name, scheme[conf.field_type], colors, scheme.get(conf.type_option_time))
+
+        assignments = []
+        inherit, inherit_index = None, 0
+        for field in scheme:
+            if field == conf.field_inherit:
+                inherit, inherit_index = scheme[field], len(assignments)
+            elif field in conf.no_color_in_scheme:
+                continue
+            elif field == conf.all_keys:
+                # all is resolved with the layout
+                assignments.append((None, self._compile_color(scheme[field])))
+            else:
+                assignments.append((frozenset(self.get_keys(field)), self._compile_color(scheme[field])))
+        return StaticScheme(name, assignments, inherit, inherit_index)
+
+    def _compile_color(self, color):
+        """
+        returns the Color for a color name or code, Colors are shared between all uses of the same color
+        """
+        if color not in self._colors:
+            rgb = self.get_color(color)
+            self._colors[color] = Color(*rgb) if rgb else Color(0, 0, 0)
+        return self._colors[color]
+
+    def get_important_keys_mode(self, mode, switch_keys=True):
+        """
+        keys to listen to when in given mode
+        switch_keys: False -> keys which only switch the mode are not included
+        """
+        if switch_keys:
+            return mode.keys
+        return mode.scheme_keys
 
     def get_color_scheme(self, pressed_keys, mode):
         """
         returns color scheme to display, when *pressed_keys* are pressed in given mode
         """
-        scheme_name = self._get_combination_value(pressed_keys, mode)
-        if not scheme_name:
-            scheme_name = mode[conf.scheme_default]
-        return self.get_color_scheme_by_name(scheme_name)
+        # precedence is from top to bottom
+        for binding in mode.bindings:
+            if binding.matches(pressed_keys):
+                return self.get_color_scheme_by_name(binding.target)
+        return self.get_color_scheme_by_name(mode.scheme)
 
     def get_next_mode(self, pressed_keys, current_mode):
         """
         return the mode to switch to, when *pressed_keys* are pressed in given mode
         """
-        next_mode_name = self._get_combination_value(pressed_keys, current_mode[conf.field_switch])
-        if not next_mode_name:
-            return current_mode
-        return self.get_mode_by_name(next_mode_name)
+        for binding in current_mode.switches:
+            if binding.matches(pressed_keys):
+                return self.get_mode_by_name(binding.target)
+        return current_mode
+
+    def get_stack_change(self, pressed_keys, current_mode):
+        """
+        returns the mode to push when *pressed_keys* are pressed in given mode, True to return to the pushed mode,
+        None if the keys do not change the mode stack
+        """
+        for binding in current_mode.pushes:
+            if binding.matches(pressed_keys):
+                return self.get_mode_by_name(binding.target)
+        if current_mode.pop and current_mode.pop.matches(pressed_keys):
+            return True
+        return None
+
+    def get_modes(self):
+        """
+        returns all compiled modes by name, these are the reachable ones and the ones requested by name
+        """
+        return self._modes
+
+    def get_color_schemes(self):
+        """
+        returns all compiled color schemes by name, these are the reachable ones and the ones requested by name
+        """
+        return self._schemes
+
+    def get_i3_modes(self):
+        """
+        returns the i3 mode names with the mode to use for them
+        """
+        return {mode.i3_mode: name for name, mode in self._modes.items()}
 
     def get_color_scheme_by_name(self, name):
         """
         returns the named color scheme, when present
         """
+        scheme = self._schemes.get(name)
+        if scheme is not None:
+            return scheme
         if name in self._configuration[conf.sec_color_schemes]:
-            return self._configuration[conf.sec_color_schemes][name]
+            # not reachable from default mode, compile it now
+            with self._compile_lock:
+                scheme = self._schemes.get(name)
+                if scheme is None:
+                    scheme = self._compile_scheme(self._configuration[conf.sec_color_schemes][name])
+                    self._schemes = {**self._schemes, name: scheme}
+            return scheme
         self._logger.error(f"color scheme {name} not found")
 
     def get_mode_by_name(self, name):
         """
         return the named mode, when present
         """
+        mode = self._modes.get(name)
+        if mode is not None:
+            return mode
         if name in self._configuration[conf.sec_modes]:
-            return self._configuration[conf.sec_modes][name]
+            # not reachable from default mode, compile it now
+            with self._compile_lock:
+                mode = self._modes.get(name)
+                if mode is None:
+                    mode = self._compile_mode(self._configuration[conf.sec_modes][name])
+                    self._modes = {**self._modes, name: mode}
+            return mode
         self._logger.warning(f"mode {name} not found")
@@ -0,0 +1,100 @@
+"""
+Watches the config files and reports changes after the editor finished saving
+"""
+import os
+import select
+import threading
+import time
+from logging import getLogger
+
+from i3razer import inotify
+
+# editors save by writing in place or by writing a new file and renaming it over the old one
+_WATCH_MASK = inotify.IN_CLOSE_WRITE | inotify.IN_MODIFY | inotify.IN_MOVED_TO | inotify.IN_MOVED_FROM | \
+              inotify.IN_CREATE | inotify.IN_DELETE
+
+
+class ConfigWatcher(threading.Thread):
+    """
+    Thread watching the directories of the config files with inotify.
+    OnChange is called in this thread once no watched file was changed for debounce seconds,
+    so a burst of writes of one save results in a single call.
+
+    OnChange    : called without arguments after files changed
+    """
+
+    def __init__(self, files, debounce=0.3, logger=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.name = "i3razer-config-watcher"
+        if not logger:
+            logger = getLogger(__name__)
+        self._logger = logger
+        self.debounce = debounce
+        self.finished = threading.Event()
+        self.OnChange = lambda: True
+
+        self._inotify = inotify.Inotify()
+        self._wake_read, self._wake_write = os.pipe()  # wakes the poll on cancel
+        self._lock = threading.Lock()
+        self._dirs = {}  # watch descriptor: directory
+        self._names = {}  # directory: names of the watched files in it
+        self.set_files(files)
+
+    def set_files(self, files):
+        """
+        changes the watched files, e.g. after a reload added an included file
+        """
+        names = {}
+        for file in files:
+            directory, name = os.path.split(os.path.abspath(file))
+            names.setdefault(directory, set()).add(name)
+        with self._lock:
+            for wd, directory in list(self._dirs.items()):
+                if directory not in names:
+                    self._inotify.rm_watch(wd)
+                    del self._dirs[wd]
+            for directory in names:
+                if directory in self._dirs.values():
+                    continue
+                try:
+                    self._dirs[self._inotify.add_watch(directory, _WATCH_MASK)] = directory
+                except OSError as e:
+                    self._logger.warning(f"Cannot watch '{directory}' for config changes: {e}")
+            self._names = names
+
+    def _is_watched(self, wd, name) -> bool:
+        with self._lock:
+            directory = self._dirs.get(wd)
+            return directory is not None and name in self._names.get(directory, ())
+
+    def run(self):
+        poll = select.poll()
+        poll.register(self._inotify.fd, select.POLLIN)
+        poll.register(self._wake_read, select.POLLIN)
+        deadline = None  # time to report the change, moved on every new event
+        try:
+            while not self.finished.is_set():
+                timeout = None if deadline is None else max(0, deadline - time.monotonic()) * 1000
+                ready = poll.poll(timeout)
+                if any(fd == self._wake_read for fd, _ in ready):
+                    return
+                if ready:
+                    if any(self._is_watched(wd, name) for wd, _, name in self._inotify.read_events()):
+                        deadline = time.monotonic() + self.debounce
+                elif deadline is not None:
+                    deadline = None
+                    self._logger.info("Config changed, reloading")
+                    self.OnChange()
+        finally:
+            self._inotify.close()
+            for fd in self._wake_read, self._wake_write:
+                os.close(fd)
+
+    def cancel(self):
+        self.finished.set()
+        try:
+            os.write(self._wake_write, b"\0")
+        except OSError:
+            # thread already finished and closed the pipe
+            pass
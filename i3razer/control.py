@@ -0,0 +1,171 @@
+"""
+Control interface of a running i3razer: a UNIX socket accepting one command per line, each answered by one line.
+
+Commands:
+    mode [NAME]                         get or change the mode
+    push [NAME]                         change the mode and remember the current one, without name: the mode stack
+    pop                                 return to the mode on top of the mode stack
+    scheme [NAME]                       get or change the color scheme
+    reload                              reload the config file
+    overlay KEYS COLOR [TIMEOUT]        light the keys in the color, answers the overlay id
+    remove_overlay [ID]                 remove the overlay, all if no id is given
+    pulse KEYS COLOR [PERIOD] [TIMEOUT] let the keys pulse, answers the animation id
+    gradient KEYS COLOR1 COLOR2 [PERIOD] [TIMEOUT]
+                                        moving gradient over the keys, answers the animation id
+    stop_animation [ID]                 stop the animation, all if no id is given
+    brightness [VALUE]                  get or set the brightness, 0 to 1
+    gamma [VALUE]                       get or set the gamma
+    white_balance [RED GREEN BLUE]      get or set the factors of the colors, 0 to 1
+Arguments containing spaces are quoted, e.g. overlay "w, a, s, d" red 2.5
+Answers start with 'ok' or 'error'
+"""
+import os
+import shlex
+import socket
+import threading
+from logging import getLogger
+
+
+def default_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "i3razer.sock")
+    return f"/tmp/i3razer-{os.getuid()}.sock"
+
+
+def send_command(command, socket_path=None, timeout=5.0) -> str:
+    """
+    sends one command to a running i3razer and returns the answer
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path or default_socket_path())
+        sock.sendall(command.encode() + b"\n")
+        with sock.makefile("r") as answer:
+            return answer.readline().rstrip("\n")
+
+
+class ControlServer(threading.Thread):
+    """
+    Thread serving the control socket for an I3Razer
+    """
+
+    def __init__(self, i3razer, socket_path=None, logger=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.name = "i3razer-control"
+        if not logger:
+            logger = getLogger(__name__)
+        self._logger = logger
+        self._i3razer = i3razer
+        self.socket_path = socket_path or default_socket_path()
+        self.finished = threading.Event()
+
+        if os.path.exists(self.socket_path):
+            # left over from a crashed instance, a running one still accepts connections
+            try:
+                send_command("mode", self.socket_path, timeout=1.0)
+            except OSError:
+                os.unlink(self.socket_path)
+            else:
+                raise OSError(f"i3razer is already listening on {self.socket_path}")
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # only the user may connect, the socket is created with these permissions (no chmod after bind,
+        # in /tmp other users could connect meanwhile)
+        umask = os.umask(0o177)
+        try:
+            self._socket.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        self._socket.listen()
+
+    def run(self):
+        while not self.finished.is_set():
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                # socket closed by cancel
+                break
+            threading.Thread(target=self._serve, args=(connection,), name="i3razer-control-client",
+                             daemon=True).start()
+
+    def _serve(self, connection):
+        with connection, connection.makefile("rw") as stream:
+            for line in stream:
+                try:
+                    answer = self.handle_command(line)
+                except (ValueError, TypeError) as e:
+                    answer = f"error {e}"
+                stream.write(answer + "\n")
+                stream.flush()
+
+    def handle_command(self, line) -> str:
+        """
+        executes one command line and returns the answer
+        """
+        args = shlex.split(line)
+        if not args:
+            return "error no command"
+        command, args = args[0], args[1:]
+        i3razer = self._i3razer
+        self._logger.info(f"Control command {command} {args}")
+        if command == "mode":
+            if not args:
+                return f"ok {i3razer.get_mode_name()}"
+            return "ok" if i3razer.change_mode(args[0]) else f"error unknown mode {args[0]}"
+        if command == "push":
+            if not args:
+                return f"ok {' '.join(i3razer.get_mode_stack())}"
+            return "ok" if i3razer.push_mode(args[0]) else f"error unknown mode {args[0]}"
+        if command == "pop":
+            return f"ok {i3razer.get_mode_name()}" if i3razer.pop_mode() else "error mode stack is empty"
+        if command == "scheme":
+            if not args:
+                return f"ok {i3razer.get_color_scheme_name()}"
+            return "ok" if i3razer.change_color_scheme(args[0]) else f"error unknown color scheme {args[0]}"
+        if command == "reload":
+            return "ok" if i3razer.reload_config() else "error in config, old config is kept"
+        if command == "overlay":
+            if len(args) not in (2, 3):
+                return "error usage: overlay KEYS COLOR [TIMEOUT]"
+            timeout = float(args[2]) if len(args) == 3 else None
+            overlay_id = i3razer.show_overlay(args[0], args[1], timeout)
+            return f"ok {overlay_id}" if overlay_id else "error unknown keys or color"
+        if command == "remove_overlay":
+            overlay_id = int(args[0]) if args else None
+            return "ok" if i3razer.remove_overlay(overlay_id) else f"error unknown overlay {overlay_id}"
+        if command == "pulse":
+            if not 2 <= len(args) <= 4:
+                return "error usage: pulse KEYS COLOR [PERIOD] [TIMEOUT]"
+            times = [float(arg) for arg in args[2:]]
+            animation_id = i3razer.pulse_keys(args[0], args[1], *times)
+            return f"ok {animation_id}" if animation_id else "error unknown keys or color"
+        if command == "gradient":
+            if not 3 <= len(args) <= 5:
+                return "error usage: gradient KEYS COLOR1 COLOR2 [PERIOD] [TIMEOUT]"
+            times = [float(arg) for arg in args[3:]]
+            animation_id = i3razer.gradient_keys(args[0], args[1], args[2], *times)
+            return f"ok {animation_id}" if animation_id else "error unknown keys or colors"
+        if command == "stop_animation":
+            animation_id = int(args[0]) if args else None
+            return "ok" if i3razer.stop_animation(animation_id) else f"error unknown animation {animation_id}"
+        if command in ("brightness", "gamma", "white_balance"):
+            if args:
+                value = [float(arg) for arg in args] if command == "white_balance" else float(args[0])
+                i3razer.set_color_correction(**{command: value})
+                return "ok"
+            value = i3razer.get_color_correction()[command]
+            return f"ok {' '.join(map(str, value)) if command == 'white_balance' else value}"
+        return f"error unknown command {command}"
+
+    def cancel(self):
+        self.finished.set()
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
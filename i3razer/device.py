@@ -0,0 +1,196 @@
+"""
+Long lived connection to the Razer keyboard via the openrazer daemon
+"""
+import threading
+from logging import getLogger
+
+import dbus
+from openrazer.client import DaemonNotFound, DeviceManager
+
+from i3razer.stats import stats
+
+DAEMON_NAME = "org.razer"
+DAEMON_PATH = "/org/razer"
+DEVICES_INTERFACE = "razer.devices"
+
+
+class DeviceSession:
+    """
+    Keeps the DeviceManager and the keyboard proxy as long as they are valid.
+    If the daemon restarts or the keyboard is unplugged, the session reconnects in the background,
+    waiting longer after each failed try (up to max_retry_wait seconds).
+    The daemon signals device_added / device_removed and the owner of its D-Bus name are watched, if
+    a GLib main loop is available (python gobject). Otherwise a lost connection is noticed on the next failed call.
+
+    OnConnect   : called with the keyboard after reconnecting in the background
+    """
+
+    def __init__(self, logger=None, max_retry_wait=30.0):
+        if not logger:
+            logger = getLogger(__name__)
+        self._logger = logger
+        self.max_retry_wait = max_retry_wait
+        self.keyboard = None
+        self.serial = ""
+        self.daemon_running = False
+        self.daemon_owner = ""  # D-Bus unique name of the daemon, changes when the daemon restarts
+        self.OnConnect = lambda keyboard: True
+
+        self._device_manager = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._wake = threading.Event()  # wakes the reconnect loop before its wait is over
+        self._reconnect_thread = None
+        self._signal_loop = None
+
+    def connect(self, timeout=0.0) -> bool:
+        """
+        connects to the keyboard, retrying for up to timeout seconds
+        return: True if a keyboard was found
+        """
+        wait = 0.5
+        remaining = timeout
+        while not self._connect_once():
+            if remaining <= 0 or self._closed.wait(min(wait, remaining)):
+                return False
+            remaining -= wait
+            wait = min(2 * wait, self.max_retry_wait)
+        return True
+
+    def _connect_once(self) -> bool:
+        """
+        finds the keyboard, a failing daemon counts as a failed try
+        """
+        with self._lock:
+            try:
+                return self._find_keyboard()
+            except DaemonNotFound:
+                self._device_manager = None
+                self.daemon_running = False
+                return False
+            except dbus.exceptions.DBusException as e:
+                # e.g. the daemon restarted while the devices were listed, the next try starts over
+                self._logger.debug("Finding the keyboard failed: %s", e)
+                self._device_manager = None
+                self.keyboard = None
+                return False
+
+    def _find_keyboard(self) -> bool:
+        """
+        a new DeviceManager is only created if the old one does not know the keyboard anymore
+        """
+        if self._device_manager is None or not self._keyboard_present():
+            self.keyboard = None
+            with stats.timed("dbus.device_manager"):
+                self._device_manager = DeviceManager()
+            stats.count("device_enumerations")
+            self.daemon_running = True
+            self.daemon_owner = self._get_daemon_owner()
+            # Without this, the daemon will try to set the lighting effect to every device.
+            self._device_manager.sync_effects = False
+        if self.keyboard is None:
+            for device in self._device_manager.devices:
+                if device.type == "keyboard":
+                    with stats.timed("dbus.serial"):
+                        self.serial = str(device.serial)
+                    self.keyboard = device
+                    break
+        return self.keyboard is not None
+
+    @staticmethod
+    def _get_daemon_owner():
+        try:
+            return str(dbus.SessionBus().get_name_owner(DAEMON_NAME))
+        except dbus.exceptions.DBusException:
+            return ""
+
+    def _keyboard_present(self) -> bool:
+        """
+        asks the daemon, if the current keyboard is still connected
+        """
+        if self.keyboard is None:
+            return False
+        try:
+            with stats.timed("dbus.get_devices"):
+                bus = dbus.SessionBus()
+                serials = bus.get_object(DAEMON_NAME, DAEMON_PATH).getDevices(dbus_interface=DEVICES_INTERFACE)
+        except dbus.exceptions.DBusException:
+            return False
+        return self.serial in [str(serial) for serial in serials]
+
+    def connection_lost(self, reason=""):
+        """
+        a call to the keyboard failed or the keyboard was removed, reconnect in the background
+        """
+        if self._closed.is_set():
+            return
+        with self._lock:
+            self.keyboard = None
+            if self._reconnect_thread and self._reconnect_thread.is_alive():
+                self._wake.set()
+                return
+            self._logger.warning(f"Lost connection to the keyboard ({reason or 'unknown reason'}), reconnecting")
+            stats.count("device_reconnects")
+            self._reconnect_thread = threading.Thread(target=self._reconnect_loop, name="i3razer-reconnect",
+                                                      daemon=True)
+            self._reconnect_thread.start()
+
+    def _reconnect_loop(self):
+        wait = 0.5
+        while not self._closed.is_set():
+            if self._connect_once():
+                self._logger.warning(f"Reconnected to keyboard {self.keyboard.name}")
+                self.OnConnect(self.keyboard)
+                return
+            self._wake.wait(wait)
+            self._wake.clear()
+            wait = min(2 * wait, self.max_retry_wait)
+
+    def _devices_changed(self, *args):
+        # a device was added or removed, only reconnect if it concerns the keyboard
+        if self.keyboard is None or not self._keyboard_present():
+            self.connection_lost("device removed" if self.keyboard else "device added")
+
+    def _daemon_owner_changed(self, owner):
+        if not owner:
+            self.daemon_running = False
+            self.connection_lost("daemon stopped")
+        elif not self.daemon_running:
+            # daemon is (re)started, old proxies are invalid
+            with self._lock:
+                self._device_manager = None
+            self.connection_lost("daemon started")
+
+    def listen_for_changes(self) -> bool:
+        """
+        starts watching the daemon for device and daemon changes
+        return: False if no GLib main loop is available for D-Bus signals
+        """
+        try:
+            from dbus.mainloop.glib import DBusGMainLoop
+            from gi.repository import GLib
+        except ImportError:
+            self._logger.info("No GLib main loop, device changes are noticed on the next failed draw")
+            return False
+        bus = dbus.SessionBus(mainloop=DBusGMainLoop(), private=True)
+        for signal_name in ("device_added", "device_removed"):
+            bus.add_signal_receiver(self._devices_changed, signal_name=signal_name,
+                                    dbus_interface=DEVICES_INTERFACE, bus_name=DAEMON_NAME)
+        bus.watch_name_owner(DAEMON_NAME, self._daemon_owner_changed)
+        self._signal_loop = GLib.MainLoop()
+        threading.Thread(target=self._signal_loop.run, name="i3razer-dbus-signals", daemon=True).start()
+        return True
+
+    @property
+    def closed(self):
+        """
+        True after close(), a closed session does not reconnect anymore
+        """
+        return self._closed.is_set()
+
+    def close(self):
+        self._closed.set()
+        self._wake.set()
+        if self._signal_loop:
+            self._signal_loop.quit()
+            self._signal_loop = None
@@ -0,0 +1,182 @@
+"""
+Reads key events directly from a keyboard device node (/dev/input/event*), without X RECORD.
+The user needs read access to the device, usually by being in the group 'input'.
+"""
+import fcntl
+import glob
+import logging
+import os
+import select
+import struct
+
+from i3razer.event_record import EventWriter
+from i3razer.key_hook import KeyHook
+
+# struct input_event from linux/input.h: struct timeval time; __u16 type; __u16 code; __s32 value
+_input_event = struct.Struct("llHHi")
+EV_KEY = 0x01
+KEY_RELEASE, KEY_PRESS, KEY_REPEAT = 0, 1, 2
+KEY_STATE_BYTES = 96  # (KEY_MAX + 1) / 8
+EVIOCGKEY = (2 << 30) | (KEY_STATE_BYTES << 16) | (ord("E") << 8) | 0x18  # _IOC_READ, reads the pressed keys
+
+# X keycodes are the evdev keycodes shifted by 8, using them keeps the key IDs equal to the HookManager ones
+X_KEYCODE_OFFSET = 8
+
+# Names of the evdev keycodes in the X us layout, used if no X display is available
+# For keysyms with several names the one the HookManager gives is used (the first of dir(XK), e.g. Page_Up not Prior)
+US_KEYSYM_NAMES = {
+    1: "Escape", 2: "1", 3: "2", 4: "3", 5: "4", 6: "5", 7: "6", 8: "7", 9: "8", 10: "9", 11: "0",
+    12: "minus", 13: "equal", 14: "BackSpace", 15: "Tab",
+    16: "q", 17: "w", 18: "e", 19: "r", 20: "t", 21: "y", 22: "u", 23: "i", 24: "o", 25: "p",
+    26: "bracketleft", 27: "bracketright", 28: "Return", 29: "Control_L",
+    30: "a", 31: "s", 32: "d", 33: "f", 34: "g", 35: "h", 36: "j", 37: "k", 38: "l",
+    39: "semicolon", 40: "apostrophe", 41: "grave", 42: "Shift_L", 43: "backslash",
+    44: "z", 45: "x", 46: "c", 47: "v", 48: "b", 49: "n", 50: "m",
+    51: "comma", 52: "period", 53: "slash", 54: "Shift_R", 55: "KP_Multiply", 56: "Alt_L", 57: "space",
+    58: "Caps_Lock", 59: "F1", 60: "F2", 61: "F3", 62: "F4", 63: "F5", 64: "F6", 65: "F7", 66: "F8", 67: "F9",
+    68: "F10", 69: "Num_Lock", 70: "Scroll_Lock", 71: "KP_Home", 72: "KP_Up", 73: "KP_Page_Up", 74: "KP_Subtract",
+    75: "KP_Left", 76: "KP_Begin", 77: "KP_Right", 78: "KP_Add", 79: "KP_End", 80: "KP_Down", 81: "KP_Next",
+    82: "KP_Insert", 83: "KP_Delete", 86: "less", 87: "F11", 88: "F12", 96: "KP_Enter", 97: "Control_R",
+    98: "KP_Divide", 99: "Print", 100: "Alt_R", 102: "Home", 103: "Up", 104: "Page_Up", 105: "Left", 106: "Right",
+    107: "End", 108: "Down", 109: "Next", 110: "Insert", 111: "Delete", 119: "Pause", 125: "Super_L",
+    126: "Super_R", 127: "Menu",
+}
+
+
+def find_keyboard_device():
+    """
+    returns the event device of a Razer keyboard, or of any keyboard if there is no Razer keyboard
+    """
+    devices = sorted(glob.glob("/dev/input/by-id/*Razer*-event-kbd")) or sorted(
+        glob.glob("/dev/input/by-id/*-event-kbd")) or sorted(glob.glob("/dev/input/by-path/*-event-kbd"))
+    return devices[0] if devices else None
+
+
+class EvdevHook(KeyHook):
+    """
+    Key event source reading struct input_event records from a device node (or any file descriptor, e.g. a pipe).
+    Hands PyxhookKeyEvents to KeyDown and KeyUp like the HookManager.
+
+    device: path of the event device, if None it is searched with find_keyboard_device()
+    fd: already opened file descriptor to read from instead of device
+    use_x_keymap: True -> name the keys with the keymap of the X server if a display is available,
+        otherwise the names of the us layout are used
+    record_file: if given, every key event is written to this file (see i3razer.event_record)
+    """
+
+    def __init__(self, device=None, fd=None, use_x_keymap=True, record_file=None):
+        KeyHook.__init__(self)
+        self.name = "i3razer-evdev"
+        if fd is None:
+            if not device:
+                device = find_keyboard_device()
+            if not device:
+                raise FileNotFoundError("no keyboard event device found")
+            fd = os.open(device, os.O_RDONLY | os.O_NONBLOCK)
+        self._fd = fd
+        self._wake_read, self._wake_write = os.pipe()  # wakes the epoll on cancel
+        self._display = None
+        if use_x_keymap:
+            try:
+                from Xlib import display
+                self._display = display.Display()
+            except Exception as e:
+                logging.info(f"No X display for key names ({e}), using us layout")
+        self._keysym_names = {}
+        self._recorder = EventWriter(record_file) if record_file else None
+
+    def keycode_name(self, keycode):
+        if self._display:
+            keysym = self._display.keycode_to_keysym(keycode, 0)
+            if keysym not in self._keysym_names:
+                from i3razer.pyxhook import keysym_to_name
+                self._keysym_names[keysym] = keysym_to_name(keysym)
+            return self._keysym_names[keysym]
+        name = US_KEYSYM_NAMES.get(keycode - X_KEYCODE_OFFSET)
+        if name is None:
+            return f"[keycode {keycode}]"
+        # same name mangling as the HookManager
+        return ("XK_" + name).lstrip("XK_")
+
+    def reset_keysyms(self):
+        self._keysym_names = {}
+        KeyHook.reset_keysyms(self)
+
+    def query_pressed(self):
+        state = bytearray(KEY_STATE_BYTES)
+        try:
+            fcntl.ioctl(self._fd, EVIOCGKEY, state)
+        except OSError:
+            # no event device, e.g. a pipe
+            return None
+        return {code + X_KEYCODE_OFFSET for code in range(256 - X_KEYCODE_OFFSET) if state[code >> 3] >> (code & 7) & 1}
+
+    def run(self):
+        epoll = select.epoll()
+        epoll.register(self._fd, select.EPOLLIN)
+        epoll.register(self._wake_read, select.EPOLLIN)
+        buffer = b""
+        try:
+            while not self.finished.is_set():
+                for fd, mask in epoll.poll():
+                    if fd == self._wake_read:
+                        return
+                    try:
+                        data = os.read(self._fd, _input_event.size * 64)
+                    except BlockingIOError:
+                        continue
+                    if not data:
+                        # end of file, e.g. the pipe was closed or the device removed
+                        return
+                    buffer += data
+                    end = len(buffer) - len(buffer) % _input_event.size
+                    for event in _input_event.iter_unpack(buffer[:end]):
+                        self._handle_event(*event)
+                    buffer = buffer[end:]
+        except OSError as e:
+            logging.error(f"Reading key events failed: {e}")
+        finally:
+            epoll.close()
+            for fd in self._fd, self._wake_read, self._wake_write:
+                os.close(fd)
+
+    def _handle_event(self, sec, usec, event_type, code, value):
+        if event_type != EV_KEY or value == KEY_REPEAT:
+            return
+        keycode = code + X_KEYCODE_OFFSET
+        if keycode > 255:
+            # not representable as X keycode, e.g. special buttons
+            return
+        if self._recorder and not self.paused:
+            self._recorder.write(sec * 1000 + usec // 1000, self._keysym(keycode), keycode, value == KEY_PRESS)
+        if value == KEY_PRESS:
+            if self._press(keycode):
+                self.KeyDown(self._make_event(keycode, "key down"))
+        elif self._release(keycode):
+            self.KeyUp(self._make_event(keycode, "key up"))
+
+    def _keysym(self, keycode):
+        """
+        returns the keysym of the keycode, which is recorded next to it
+        """
+        if self._display:
+            return self._display.keycode_to_keysym(keycode, 0)
+        name = US_KEYSYM_NAMES.get(keycode - X_KEYCODE_OFFSET)
+        if name is None:
+            return 0
+        from Xlib import XK
+        return XK.string_to_keysym(name)
+
+    def _make_event(self, keycode, message_name):
+        from i3razer.pyxhook import PyxhookKeyEvent
+        return PyxhookKeyEvent(None, None, None, self.keycode_name(keycode), 0, False, keycode, message_name)
+
+    def cancel(self):
+        self.finished.set()
+        try:
+            os.write(self._wake_write, b"\0")
+        except OSError:
+            # thread already finished and closed the pipe
+            pass
+        if self._recorder:
+            self._recorder.close()
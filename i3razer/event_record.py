@@ -0,0 +1,109 @@
+"""
+Record and replay of raw key event streams
+
+A record file starts with MAGIC, followed by fixed size little endian records:
+    time (uint32, X server time in ms), keysym (uint32), keycode (uint8), pressed (uint8)
+The keysym is stored next to the keycode, so a record can be replayed without a running X server
+"""
+import struct
+import threading
+import time
+
+from i3razer.key_hook import KeyHook
+
+MAGIC = b"I3RZREC\x01"
+_record = struct.Struct("<IIBB")
+
+
+class EventWriter:
+    """
+    Writes key events to a record file
+    """
+    _file = None
+    _lock = None
+
+    def __init__(self, record_file):
+        self._lock = threading.Lock()
+        # unbuffered, the last events before a crash or kill are the interesting ones
+        self._file = open(record_file, "wb", buffering=0)
+        self._file.write(MAGIC)
+
+    def write(self, event_time, keysym, keycode, pressed):
+        with self._lock:
+            if self._file:
+                self._file.write(_record.pack(event_time & 0xffffffff, keysym & 0xffffffff, keycode, pressed))
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+def read_events(record_file):
+    """
+    yields (time, keysym, keycode, pressed) for each event in the record file
+    """
+    with open(record_file, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"'{record_file}' is no i3razer record file")
+        data = file.read()
+    # a truncated last record (e.g. recording was killed) is dropped
+    end = len(data) - len(data) % _record.size
+    yield from _record.iter_unpack(data[:end])
+
+
+class ReplayHook(KeyHook):
+    """
+    Feeds a recorded event stream to KeyDown and KeyUp, like the HookManager does for live events.
+    realtime: True -> keep the original timing between events
+        False -> replay as fast as possible
+    """
+
+    def __init__(self, record_file, realtime=True):
+        KeyHook.__init__(self)
+        self.record_file = record_file
+        self.realtime = realtime
+        self.events_replayed = 0
+        self.duration = 0.0
+        self._events = list(read_events(record_file))
+        # the record stores the keysym of each keycode, which gives the key names without X
+        self._keysyms = {keycode: keysym for _, keysym, keycode, _ in self._events}
+
+    def keycode_name(self, keycode):
+        from i3razer.pyxhook import keysym_to_name
+        if keycode in self._keysyms:
+            return keysym_to_name(self._keysyms[keycode])
+        return f"[keycode {keycode}]"
+
+    def run(self):
+        # import here, so loading this module does not import Xlib
+        from i3razer.pyxhook import keysym_to_name
+
+        start = time.monotonic()
+        first_time = None
+        for event_time, keysym, keycode, pressed in self._events:
+            if self.finished.is_set():
+                break
+            if self.realtime:
+                if first_time is None:
+                    first_time = event_time
+                delay = (event_time - first_time) / 1000 - (time.monotonic() - start)
+                if delay > 0 and self.finished.wait(delay):
+                    break
+            self.events_replayed += 1
+            if pressed:
+                if self._press(keycode):
+                    self.KeyDown(self._make_event(keysym_to_name(keysym), keysym, keycode, "key down"))
+            else:
+                if self._release(keycode):
+                    self.KeyUp(self._make_event(keysym_to_name(keysym), keysym, keycode, "key up"))
+        self.duration = time.monotonic() - start
+
+    @staticmethod
+    def _make_event(key, keysym, keycode, message_name):
+        from i3razer.pyxhook import PyxhookKeyEvent
+        return PyxhookKeyEvent(None, None, None, key, keysym % 256, False, keycode, message_name)
+
+    def cancel(self):
+        self.finished.set()
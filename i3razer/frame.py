@@ -0,0 +1,44 @@
+"""
+Frames are the colors of the whole keyboard matrix as one RGB byte string in row major order.
+A frame of a keyboard with rows x cols keys has rows * cols * 3 bytes.
+"""
+
+
+def new_frame(rows, cols) -> bytearray:
+    """
+    returns a black frame
+    """
+    return bytearray(rows * cols * 3)
+
+
+def set_color(frame, cols, position, color):
+    """
+    sets the color (r, g, b) of the key at position (row, col)
+    """
+    index = (position[0] * cols + position[1]) * 3
+    frame[index:index + 3] = bytes(color)
+
+
+def draw_frame(advanced_fx, frame, cols):
+    """
+    shows the frame on the keyboard via the openrazer advanced matrix
+    """
+    matrix = advanced_fx.matrix
+    matrix.reset()
+    for index in range(0, len(frame), 3):
+        color = frame[index:index + 3]
+        if any(color):
+            # reset sets all keys black, only colored keys need to be set
+            matrix[divmod(index // 3, cols)] = tuple(color)
+    advanced_fx.draw()
+
+
+def draw_cells(advanced_fx, frame, cols, cells):
+    """
+    shows the changed cells of the frame on the keyboard, the other keys keep the color of the last draw
+    """
+    matrix = advanced_fx.matrix
+    for cell in cells:
+        index = cell * 3
+        matrix[divmod(cell, cols)] = tuple(frame[index:index + 3])
+    advanced_fx.draw()
@@ -0,0 +1,192 @@
+"""
+Frame bank: the prerendered frames of all static color schemes of a config in one file next to the config.
+The file is memory mapped on start, the frames of the snapshot are views into the mapping, so nothing is rendered
+and the pages are shared by all processes using the bank.
+
+File format:
+    MAGIC, index length (uint32 little endian), index (json), the frames one after another from data_offset
+    index: {"digest": ..., "layout": ..., "rows": ..., "cols": ..., "data_offset": ..., "schemes": [names]}
+A bank belongs to the content of the config files, the layout, the size of the keyboard matrix and FORMAT_VERSION
+(the digest). A bank with another digest is outdated and ignored.
+"""
+import json
+import mmap
+import os
+import struct
+from hashlib import sha1
+from logging import getLogger
+
+from i3razer.config_model import StaticScheme
+from i3razer.config_parser import ConfigParser
+from i3razer.layout import layouts
+from i3razer.snapshot import Snapshot
+from i3razer.stats import stats
+from i3razer.warm_state import StateStore
+
+MAGIC = b"I3RZFRM1"
+FORMAT_VERSION = 1  # part of the digest, increase it when the file layout or the rendering of the frames changes
+_INDEX_LENGTH = struct.Struct("<I")
+_ALIGN = 64  # frames start at this alignment
+
+
+def bank_file(config_file, layout_name, rows, cols):
+    """
+    returns the path of the bank of the config for the layout and keyboard size, next to the config
+    """
+    return f"{os.path.splitext(os.path.abspath(config_file))[0]}.{layout_name}.{rows}x{cols}.frames"
+
+
+def bank_digest(config, layout_name, layout, rows, cols):
+    """
+    returns the digest of what the frames are rendered from: the config files, the layout and the keyboard size,
+    and of the format version
+    """
+    digest = sha1(repr((FORMAT_VERSION, layout_name, sorted(layout.items()), rows, cols)).encode())
+    for path in config.get_files():
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+class FrameBank:
+    """
+    A memory mapped bank file, get() returns read only views of its frames without copying
+    """
+
+    def __init__(self, path):
+        """
+        raises OSError if the file cannot be mapped, ValueError if it is no valid bank
+        """
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = len(MAGIC) + _INDEX_LENGTH.size
+            if self._map[:len(MAGIC)] != MAGIC:
+                raise ValueError("not a frame bank")
+            index_length, = _INDEX_LENGTH.unpack_from(self._map, len(MAGIC))
+            index = json.loads(self._map[header:header + index_length].decode())
+            self.digest = index["digest"]
+            self.layout_name = index["layout"]
+            self.rows = index["rows"]
+            self.cols = index["cols"]
+            frame_size = self.rows * self.cols * 3
+            offset = index["data_offset"]
+            if offset + len(index["schemes"]) * frame_size > len(self._map):
+                raise ValueError("truncated")
+        except (KeyError, TypeError, struct.error, UnicodeDecodeError) as e:
+            self._map.close()
+            raise ValueError(f"invalid index: {e}")
+        except ValueError:
+            self._map.close()
+            raise
+        view = memoryview(self._map)
+        self._frames = {name: view[offset + i * frame_size:offset + (i + 1) * frame_size]
+                        for i, name in enumerate(index["schemes"])}
+        stats.set("frame_bank.mapped_bytes", len(self._map))
+
+    def get(self, scheme_name):
+        """
+        returns the frame of the scheme as memoryview, None if the scheme is not in the bank
+        """
+        frame = self._frames.get(scheme_name)
+        stats.cache("frame_bank", frame is not None)
+        return frame
+
+    def __len__(self):
+        return len(self._frames)
+
+
+def open_bank(config_file, config, layout_name, rows, cols, logger=None):
+    """
+    returns the FrameBank of the config for the layout and keyboard size, None if there is no valid one
+    """
+    if not logger:
+        logger = getLogger(__name__)
+    path = bank_file(config_file, layout_name, rows, cols)
+    try:
+        bank = FrameBank(path)
+        digest = bank_digest(config, layout_name, layouts[layout_name], rows, cols)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring frame bank '{path}': {e}")
+        return None
+    if bank.digest != digest:
+        logger.info(f"Frame bank '{path}' is outdated, rebuild it with --build-frames")
+        return None
+    logger.info(f"Using {len(bank)} frames of frame bank '{path}'")
+    return bank
+
+
+def write_bank(config_file, snapshot):
+    """
+    renders every static color scheme of the config (also the unreachable ones) into the bank file of the snapshot
+    The file is replaced atomically, processes which mapped the old file keep using it
+    returns: path of the bank file
+    """
+    config = snapshot.config
+    names = list(config.get_color_schemes()) + list(config.get_unreachable()[1])
+    schemes = [config.get_color_scheme_by_name(name) for name in names]
+    frames = [(scheme.name, snapshot.get_frame(scheme)) for scheme in schemes if isinstance(scheme, StaticScheme)]
+
+    index = {"digest": bank_digest(config, snapshot.layout_name, snapshot.layout, snapshot.rows, snapshot.cols),
+             "layout": snapshot.layout_name, "rows": snapshot.rows, "cols": snapshot.cols, "data_offset": 0,
+             "schemes": [name for name, _ in frames]}
+    # the offset is part of the index, its digits change the length of the index
+    while True:
+        data = json.dumps(index).encode()
+        offset = -(-(len(MAGIC) + _INDEX_LENGTH.size + len(data)) // _ALIGN) * _ALIGN
+        if offset == index["data_offset"]:
+            break
+        index["data_offset"] = offset
+    header = MAGIC + _INDEX_LENGTH.pack(len(data)) + data
+
+    path = bank_file(config_file, snapshot.layout_name, snapshot.rows, snapshot.cols)
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as file:
+        file.write(header.ljust(offset, b"\0"))
+        for _, frame in frames:
+            file.write(frame)
+    os.replace(tmp_file, path)
+    return path
+
+
+def build_frame_banks(config_file, layout_name=None, size=None, state_file=None) -> bool:
+    """
+    writes the frame banks of the config, for the given layout and size ('ROWSxCOLS') or else for every keyboard
+    remembered in the state file (the given layout replaces the remembered one)
+    returns: False on errors
+    """
+    targets = []
+    if size:
+        try:
+            rows, cols = (int(value) for value in size.lower().split("x"))
+        except ValueError:
+            print(f"Invalid keyboard size '{size}', expected ROWSxCOLS, e.g. 6x22")
+            return False
+        targets.append((layout_name or "en_US", rows, cols))
+    else:
+        for facts in StateStore(state_file).get_devices().values():
+            if facts.get("rows") and facts.get("cols"):
+                targets.append((layout_name or facts.get("layout") or "en_US", facts["rows"], facts["cols"]))
+        if not targets:
+            print("No keyboard remembered yet, run i3razer once or give the size with --frames-size ROWSxCOLS")
+            return False
+
+    config = ConfigParser(config_file)
+    if not config.is_integral():
+        print("Error while loading config file")
+        return False
+    for target in sorted(set(targets)):
+        layout_name, rows, cols = target
+        if layout_name not in layouts:
+            print(f"Layout {layout_name} not found")
+            return False
+        snapshot = Snapshot(config, layout_name, layouts[layout_name], rows, cols)
+        try:
+            path = write_bank(config_file, snapshot)
+        except OSError as e:
+            print(f"Could not write frame bank: {e}")
+            return False
+        print(f"Wrote {len(snapshot.frames)} frames for {layout_name} {rows}x{cols} to {path}")
+    return True
@@ -0,0 +1,181 @@
+"""
+Counts the key presses per key and mode and renders them as heatmap color scheme
+"""
+import json
+import math
+import os
+import threading
+from array import array
+from logging import getLogger
+
+from i3razer.frame import new_frame, set_color
+
+MAX_MODES = 64  # slots of counters, the last one is shared by the modes which do not get an own slot
+OTHER_MODES = "*other modes*"  # name the presses in the shared slot are saved with
+KEYCODES = 256
+
+
+def default_usage_file():
+    state_home = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+    return os.path.join(state_home, "i3razer", "usage.json")
+
+
+class KeyUsage:
+    """
+    Press counters in one integer array, indexed by mode slot * 256 + keycode.
+    count() is called by the key hook for every press and only increments an array entry,
+    the key names are resolved when the counts are read or flushed.
+    The counts are added to the ones of earlier runs and written every flush_interval seconds.
+
+    keycode_name: function of the key hook returning the key name of a keycode, set when attached to a hook
+    """
+
+    def __init__(self, usage_file=None, flush_interval=300.0, logger=None):
+        if not logger:
+            logger = getLogger(__name__)
+        self._logger = logger
+        self.usage_file = usage_file or default_usage_file()
+        self.flush_interval = flush_interval
+        self.keycode_name = None
+
+        self._counts = array("L", bytes(array("L").itemsize * KEYCODES * MAX_MODES))
+        self._modes = {}  # mode name -> slot
+        self._offset = 0  # slot * 256 of the current mode
+        self._saved = {}  # mode name -> key name -> count of earlier runs
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time, they share the temporary file
+        self._timer = None
+        self._stopped = True  # no flush timer is armed anymore, also not by a running flush
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.usage_file, "r") as file:
+                usage = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self._logger.warning(f"Ignoring usage file '{self.usage_file}': {e}")
+            return
+        if isinstance(usage, dict) and isinstance(usage.get("modes"), dict):
+            self._saved = usage["modes"]
+
+    def set_mode(self, mode_name):
+        """
+        following presses are counted for the mode
+        """
+        slot = self._modes.get(mode_name)
+        if slot is None:
+            slot = self._modes[mode_name] = min(len(self._modes), MAX_MODES - 1)
+            if slot == MAX_MODES - 1:
+                self._logger.info(f"More than {MAX_MODES - 1} modes, counting '{mode_name}' as '{OTHER_MODES}'")
+        self._offset = slot * KEYCODES
+
+    def count(self, keycode):
+        self._counts[self._offset + keycode] += 1
+
+    def get_counts(self, mode_name=None) -> dict:
+        """
+        returns key name -> presses of the mode, of all modes if no mode is given
+        """
+        counts = {}
+        modes = self._get_all_counts()
+        if mode_name and self._modes.get(mode_name) == MAX_MODES - 1:
+            # counted in the shared slot
+            mode_name = OTHER_MODES
+        for name in ([mode_name] if mode_name else modes):
+            for key, presses in modes.get(name, {}).items():
+                counts[key] = counts.get(key, 0) + presses
+        return counts
+
+    def _get_all_counts(self) -> dict:
+        """
+        returns mode name -> key name -> presses, including the counts of earlier runs
+        """
+        modes = {mode: dict(keys) for mode, keys in self._saved.items()}
+        if not self.keycode_name:
+            return modes
+        # the shared slot is counted once
+        slots = {slot: OTHER_MODES if slot == MAX_MODES - 1 else mode for mode, slot in self._modes.items()}
+        for slot, mode in slots.items():
+            keys = modes.setdefault(mode, {})
+            offset = slot * KEYCODES
+            for keycode, presses in enumerate(self._counts[offset:offset + KEYCODES]):
+                if presses:
+                    key = self.keycode_name(keycode).lower()
+                    keys[key] = keys.get(key, 0) + presses
+        return modes
+
+    def flush(self):
+        """
+        writes the counts atomically to the usage file
+        """
+        with self._flush_lock:
+            with self._lock:
+                data = json.dumps({"modes": self._get_all_counts()}, indent=1, sort_keys=True)
+            try:
+                os.makedirs(os.path.dirname(self.usage_file), exist_ok=True)
+                tmp_file = f"{self.usage_file}.{os.getpid()}.tmp"
+                with open(tmp_file, "w") as file:
+                    file.write(data)
+                os.replace(tmp_file, self.usage_file)
+            except OSError as e:
+                self._logger.warning(f"Could not write usage file '{self.usage_file}': {e}")
+
+    def start_flushing(self):
+        """
+        flushes every flush_interval seconds until stop_flushing() is called
+        """
+        with self._lock:
+            self._stopped = False
+            self._start_timer()
+
+    def _start_timer(self):
+        # called with the lock held
+        self._timer = threading.Timer(self.flush_interval, self._flush_and_repeat)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_and_repeat(self):
+        self.flush()
+        with self._lock:
+            # stop_flushing() may have been called during the flush
+            if not self._stopped:
+                self._start_timer()
+
+    def stop_flushing(self):
+        with self._lock:
+            self._stopped = True
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+        self.flush()
+
+
+def color_ramp(colors, steps=256):
+    """
+    returns steps colors (as bytes) interpolated between the given colors
+    """
+    colors = [tuple(color) for color in colors]
+    if len(colors) == 1:
+        colors.insert(0, (0, 0, 0))
+    ramp = []
+    for step in range(steps):
+        position = step / (steps - 1) * (len(colors) - 1)
+        index = min(int(position), len(colors) - 2)
+        ratio = position - index
+        ramp.append(bytes(round(a + (b - a) * ratio) for a, b in zip(colors[index], colors[index + 1])))
+    return ramp
+
+
+def render_heatmap(layout, rows, cols, counts, ramp):
+    """
+    returns a frame coloring each key of the layout by its presses, on a logarithmic scale of the ramp
+    """
+    frame = new_frame(rows, cols)
+    most = max(counts.values(), default=0)
+    scale = (len(ramp) - 1) / math.log1p(most) if most else 0
+    for key, position in layout.items():
+        if position[0] < rows and position[1] < cols:
+            set_color(frame, cols, position, ramp[int(math.log1p(counts.get(key, 0)) * scale)])
+    return frame
@@ -0,0 +1,140 @@
+"""
+Listens to mode changes of i3 via its IPC socket (https://i3wm.org/docs/ipc.html)
+"""
+import json
+import logging
+import os
+import socket
+import struct
+import subprocess
+import threading
+
+MAGIC = b"i3-ipc"
+_header = struct.Struct("<II")  # payload length, message type
+
+# message types
+MSG_SUBSCRIBE = 2
+MSG_GET_BINDING_STATE = 12
+
+# event types, events have the highest bit set
+EVENT_MASK = 1 << 31
+EVENT_MODE = EVENT_MASK | 2
+EVENT_BINDING = EVENT_MASK | 5
+
+
+def get_socket_path():
+    """
+    returns the path of the i3 IPC socket
+    """
+    if os.environ.get("I3SOCK"):
+        return os.environ["I3SOCK"]
+    try:
+        return subprocess.run(["i3", "--get-socketpath"], capture_output=True, check=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class I3ModeListener(threading.Thread):
+    """
+    Connects to the i3 IPC socket and subscribes to mode events.
+    OnMode      : called with the name of the i3 mode, on connect and on every mode change
+    OnBinding   : called with the binding of each binding event, only if bindings is True
+    If the connection is lost (e.g. i3 restarts) it reconnects, waiting up to max_retry_wait seconds between tries
+    """
+
+    def __init__(self, socket_path=None, bindings=False, max_retry_wait=5.0):
+        threading.Thread.__init__(self, name="i3razer-i3-ipc", daemon=True)
+        self.finished = threading.Event()
+        self.socket_path = socket_path
+        self.bindings = bindings
+        self.max_retry_wait = max_retry_wait
+        self.OnMode = lambda x: True
+        self.OnBinding = lambda x: True
+        self._socket = None
+
+    def run(self):
+        retry_wait = 0.1
+        while not self.finished.is_set():
+            try:
+                self._connect()
+                retry_wait = 0.1
+                self._listen()
+            except (OSError, ValueError) as e:
+                if self.finished.is_set():
+                    break
+                logging.warning(f"i3 IPC connection failed: {e}, retrying in {retry_wait:.1f}s")
+            self._close()
+            if self.finished.wait(retry_wait):
+                break
+            retry_wait = min(2 * retry_wait, self.max_retry_wait)
+
+    def cancel(self):
+        self.finished.set()
+        sock = self._socket
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _connect(self):
+        path = self.socket_path or get_socket_path()
+        if not path:
+            raise OSError("i3 socket path not found")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        self._socket = sock
+
+        events = ["mode", "binding"] if self.bindings else ["mode"]
+        self._send(MSG_SUBSCRIBE, json.dumps(events))
+        reply_type, reply = self._receive()
+        if reply_type != MSG_SUBSCRIBE or not reply.get("success"):
+            raise ValueError(f"subscribing to {events} failed: {reply}")
+
+        # the mode events only tell about changes, ask for the current mode (i3 >= 4.19)
+        self._send(MSG_GET_BINDING_STATE, "")
+        # events can arrive before the reply
+        while True:
+            reply_type, reply = self._receive()
+            if reply_type == MSG_GET_BINDING_STATE:
+                if "name" in reply:
+                    self.OnMode(reply["name"])
+                break
+            self._dispatch(reply_type, reply)
+
+    def _listen(self):
+        while not self.finished.is_set():
+            self._dispatch(*self._receive())
+
+    def _dispatch(self, message_type, payload):
+        if message_type == EVENT_MODE:
+            self.OnMode(payload["change"])
+        elif message_type == EVENT_BINDING:
+            self.OnBinding(payload.get("binding"))
+
+    def _close(self):
+        if self._socket:
+            self._socket.close()
+            self._socket = None
+
+    def _send(self, message_type, payload):
+        data = payload.encode()
+        self._socket.sendall(MAGIC + _header.pack(len(data), message_type) + data)
+
+    def _receive(self):
+        header = self._receive_exactly(len(MAGIC) + _header.size)
+        if not header.startswith(MAGIC):
+            raise ValueError("invalid i3 IPC message")
+        length, message_type = _header.unpack(header[len(MAGIC):])
+        payload = json.loads(self._receive_exactly(length)) if length else {}
+        return message_type, payload
+
+    def _receive_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise OSError("i3 IPC connection closed")
+            data += chunk
+        return data
@@ -1,52 +1,146 @@
+import threading
 from logging import getLogger
+from zlib import crc32
 
-from openrazer.client import DaemonNotFound, DeviceManager, constants as razer_constants
+from dbus.exceptions import DBusException
+from openrazer.client import constants as razer_constants
 
 from i3razer import config_contants as conf
+from i3razer.animation import Animator, Fade, Gradient, Pulse
+from i3razer.color_pipeline import ColorPipeline
+from i3razer.compositor import LAYER_ANIMATION, LAYER_OVERLAY, LAYER_SCHEME, Compositor
+from i3razer.config_model import HeatmapScheme, StaticScheme
 from i3razer.config_parser import ConfigParser
+from i3razer.config_watcher import ConfigWatcher
+from i3razer.control import ControlServer
+from i3razer.device import DeviceSession
+from i3razer.frame import draw_cells, draw_frame, new_frame
+from i3razer.frame_bank import open_bank
+from i3razer.heatmap import KeyUsage, render_heatmap
+from i3razer.i3_ipc import I3ModeListener
 from i3razer.layout import layouts
+from i3razer.lock_watcher import LockWatcher
+from i3razer.log_limit import LogLimiter
+from i3razer.mode_stack import ModeStack, StackEntry
 from i3razer.pyxhook import HookManager
+from i3razer.snapshot import Snapshot
+from i3razer.stats import stats
+from i3razer.status_export import StatusExport
+from i3razer.warm_state import StateStore
 
 ERR_DAEMON_OFF = -2  # openrazer is not running
 ERR_NO_KEYBOARD = -3  # no razer keyboard found
 ERR_CONFIG = -4  # Error in config file
 
+CONNECT_TIMEOUT = 10.0  # seconds to wait for the daemon and the keyboard on startup
+LOCK_OFF = "off"  # lock scheme which turns the lights off
+
 
 class I3Razer:
     _logger = None
+    _log_limit = None  # LogLimiter for warnings while handling key events
 
     # Keyboard settings
     _serial = ""
-    _keyboard = None
-    _key_layout = {}
+    _keyboard = None  # None while the connection to the keyboard is lost
+    _session = None  # DeviceSession, keeps the connection to the daemon and reconnects
     _key_layout_name = ""  # Only present if layout is set manually
+    _state = None  # StateStore, remembers keyboard facts and the drawn scheme over restarts
+    _pipeline = ColorPipeline()  # color correction of the keyboard, applied to every frame sent to it
+
+    # Config, layout and prerendered frames. Replaced as a whole on reload, never changed in place
+    _snapshot = None
+    _config_file = ""
+    _config = None  # config which is not yet in a snapshot, only used while loading
+    _tried_config_files = ()  # files of the last reload, also if it failed
 
     # handle modes and keys
-    _listen_to_keys = set()  # the keys which could change the displayed color scheme
     _current_pressed_keys = set()
     _current_scheme_name = ""
-    _mode = None
-
-    _config = None
-    _drawing_scheme = set()  # prevent infinite inherit loop in color schemes
+    _recorded_drawn = None  # (mode, scheme, daemon, snapshot, pipeline) last saved with StateStore.set_drawn
+    _compositor = None  # layers of the frame on the keyboard, None if the keyboard does not show it (e.g. effect)
+    _mode_name = ""  # the mode is looked up by name in the current snapshot
+    _mode_stack = None  # ModeStack of the modes left with push_mode
+    _overlays = None  # overlay id -> (keys, color bytes, timer), drawn in the order of their ids
+    _next_overlay_id = 1
+    _draw_lock = None  # drawing is done from the hook, i3, config, control and overlay timer threads
 
     # Thread handling
     _hook = None
+    _i3_listener = None
+    _config_watcher = None
+    _control = None
+    _animator = None
+    _status = None  # StatusExport while started
+    _usage = None  # KeyUsage counting the key presses for heatmaps
+    _lock_watcher = None
     _running = False
+    _paused = False  # the screen is locked, nothing is drawn
 
-    def __init__(self, config_file, layout=None, logger=None):
+    _i3_ipc = False  # modes are switched by i3 mode events and not by switch_mode keys
+    _watch_config = False  # reload the config when its files change
+    _control_socket = False  # serve the control interface on this socket
+    _fps = 30  # frame rate of software animations
+    _fade = 0.0  # seconds to fade between static color schemes
+    _status_file = False  # export the status to this file
+    _watch_lock = False  # pause while the screen is locked
+    _lock_command = None  # command telling if the screen is locked, see LockWatcher
+    _lock_scheme = None  # color scheme shown while the screen is locked, LOCK_OFF for no lights
+    _frame_bank = True  # use the frame bank next to the config instead of rendering the frames
+
+    def __init__(self, config_file, layout=None, logger=None, i3_ipc=False, state_file=None, watch_config=False,
+                 control_socket=False, fps=30, fade=0.0, brightness=None, gamma=None, status_file=False,
+                 usage_file=False, watch_lock=False, lock_command=None, lock_scheme=None, frame_bank=True):
         """
         config_file: path to the config file
         layout: keyboard Layout to use for lighting the keys. If none is given it is detected automatically
         logger: Logger to use for logging
+        i3_ipc: True -> follow the mode of i3 via its IPC socket, switch_mode in the config is ignored
+            the mode with the same name (or field i3_mode) as the i3 mode is used
+            a path to an i3 socket can be given instead of True
+        state_file: file to remember the state over restarts, defaults to $XDG_STATE_HOME/i3razer/state.json
+        watch_config: True -> reload the config automatically when the file is saved, while started
+        control_socket: True -> serve the control interface (see control.py) on the default socket while started,
+            a path to the socket can be given instead of True
+        fps: frame rate of software animations (fades, pulses, gradients)
+        fade: seconds to fade from one static color scheme to the next, 0 to switch at once
+        brightness, gamma: color correction, see ColorPipeline. If None the one of the last run is used
+        status_file: True -> export mode, scheme and pressed keys for status bars (see status_export.py)
+            while started, a path to the file can be given instead of True
+        usage_file: True -> count the key presses for heatmap color schemes and save them in
+            $XDG_STATE_HOME/i3razer/usage.json, a path to the file can be given instead of True
+        watch_lock: True -> pause the key handling and drawing while the screen saver is active or the screen is
+            locked according to lock_command (a shell command exiting with 0 while locked, e.g. 'pgrep -x i3lock')
+        lock_scheme: color scheme shown while locked, LOCK_OFF to turn the lights off, None to keep the scheme
+        frame_bank: True -> memory map the frames of the static schemes from the frame bank next to the config,
+            if it was built for the config, layout and keyboard size (see frame_bank.py)
         """
         if not logger:
             logger = getLogger(__name__)
         self._logger = logger
+        self._log_limit = LogLimiter(logger)
+        self._i3_ipc = i3_ipc
+        self._watch_config = watch_config
+        self._control_socket = control_socket
+        self._fps = fps
+        self._fade = fade
+        self._status_file = status_file
+        self._watch_lock = watch_lock
+        self._lock_command = lock_command
+        self._lock_scheme = lock_scheme
+        self._frame_bank = frame_bank
+        if usage_file:
+            self._usage = KeyUsage(usage_file if isinstance(usage_file, str) else None, logger=logger)
+        self._overlays = {}
+        self._mode_stack = ModeStack()
+        self._draw_lock = threading.RLock()
+        self._state = StateStore(state_file, logger=logger)
+        self._open_session()
         self._logger.info("Loading config")
         self._load_config(config_file)
         self._logger.info("Loading Razer Keyboard")
         self._load_keyboard(layout)
+        self._load_color_correction(brightness, gamma)
         self._logger.info("Loading done")
 
     def _update_color_scheme(self):
@@ -54,66 +148,282 @@ class I3Razer:
         Determines which color scheme should be displayed and displays it
         """
         if self._running:
-            if not self._mode:
-                self._mode = self._config.get_mode_by_name(conf.mode_default)
-                self._listen_to_keys = self._config.get_important_keys_mode(self._mode)
-            self._logger.debug(f"pressed keys: {self._current_pressed_keys} in mode {self._mode[conf.field_name]}")
+            # the mode is resolved and its scheme drawn at once, the hook, i3, control and lock threads change modes
+            with self._draw_lock:
+                # read the snapshot once, a reload in another thread does not change it while handling the event
+                snapshot = self._snapshot
+                if not self._mode_name:
+                    self._set_mode(snapshot, conf.mode_default)
+                mode = snapshot.config.get_mode_by_name(self._mode_name)
+                self._logger.debug("pressed keys: %s in mode %s", self._current_pressed_keys, self._mode_name)
+
+                # find mode, with i3 IPC the mode is changed in _on_i3_mode
+                if not self._i3_ipc:
+                    next_mode = snapshot.config.get_next_mode(self._current_pressed_keys, mode)
+                    if next_mode is not mode:
+                        # swapped to a new mode
+                        stats.count("mode_switches")
+                        mode = next_mode
+                        self._set_mode(snapshot, mode.name)
+                    else:
+                        change = snapshot.config.get_stack_change(self._current_pressed_keys, mode)
+                        if change is True:
+                            mode = self._pop_mode(snapshot) or mode
+                        elif change:
+                            self._push_mode(snapshot, mode, change)
+                            mode = change
+
+                # update color scheme for mode
+                scheme = snapshot.config.get_color_scheme(self._current_pressed_keys, mode)
+                self._draw_color_scheme(snapshot, scheme)
+                self._export_status()
+
+    def _export_status(self):
+        if self._status:
+            self._status.update(self.get_mode_name(), self._current_scheme_name, self._current_pressed_keys)
+
+    def _set_mode(self, snapshot, mode_name):
+        """
+        sets the current mode and tells the hook which keys are relevant in the mode
+        """
+        self._mode_name = mode_name
+        if self._usage:
+            self._usage.set_mode(mode_name)
+        if self._hook:
+            self._hook.set_relevant_keys(snapshot.get_listen_keys(mode_name))
 
-            # find mode
-            next_mode = self._config.get_next_mode(self._current_pressed_keys, self._mode)
-            if next_mode[conf.field_name] != self._mode[conf.field_name]:
-                # swapped to a new mode
-                self._mode = next_mode
-                self._listen_to_keys = self._config.get_important_keys_mode(self._mode)
+    def _push_mode(self, snapshot, mode, next_mode):
+        """
+        enters the next mode and remembers the mode with the frame of its default scheme on the mode stack
+        """
+        with self._draw_lock:
+            scheme_name = self._current_scheme_name
+            compositor = None
+            base = snapshot.config.get_color_scheme_by_name(mode.scheme)
+            shown = snapshot.config.get_color_scheme_by_name(scheme_name) if scheme_name else None
+            if self._compositor and isinstance(base, StaticScheme) and isinstance(shown, StaticScheme):
+                # the base layer holds the default scheme of the mode, which is kept without the pressed keys' scheme
+                compositor = self._compositor.copy()
+                compositor.set_layer(LAYER_SCHEME, {})
+                scheme_name = base.name
+            self._mode_stack.push(StackEntry(snapshot, mode, scheme_name, compositor))
+        stats.count("mode_switches")
+        self._set_mode(snapshot, next_mode.name)
 
-            # update color scheme for mode
-            scheme = self._config.get_color_scheme(self._current_pressed_keys, self._mode)
-            self._draw_color_scheme(scheme)
+    def _pop_mode(self, snapshot):
+        """
+        returns to the mode on top of the mode stack and shows its cached frame
+        return: the mode, None if the stack is empty
+        """
+        entry = self._mode_stack.pop()
+        if not entry:
+            return None
+        if entry.snapshot is snapshot:
+            mode = entry.mode
+        else:
+            # reloaded since the mode was left, the cached frame is outdated
+            mode = snapshot.config.get_mode_by_name(entry.mode.name) or \
+                snapshot.config.get_mode_by_name(conf.mode_default)
+        stats.count("mode_switches")
+        self._set_mode(snapshot, mode.name)
+        if entry.snapshot is snapshot and entry.compositor:
+            self._draw_cached(snapshot, entry)
+        return mode
 
-    def _draw_color_scheme(self, color_config):
+    def _draw_cached(self, snapshot, entry):
+        """
+        shows the compositor of a mode stack entry again, only the overlay and animation layers are updated
+        """
+        with self._draw_lock:
+            if not self._keyboard or self._paused:
+                return
+            compositor = entry.compositor
+            shown = self._compositor
+            compositor.set_layer(LAYER_OVERLAY, self._overlay_cells(snapshot))
+            if self._animator:
+                compositor.set_layer(LAYER_ANIMATION, self._animator.current_cells())
+            self._compositor = compositor
+            self._current_scheme_name = entry.scheme_name
+            stats.count("mode_stack.cached_draws")
+            try:
+                if shown and (shown.rows, shown.cols) == (compositor.rows, compositor.cols):
+                    frame, old = compositor.frame, shown.frame
+                    self._draw_changed_cells(snapshot, [cell for cell in range(compositor.rows * compositor.cols)
+                                                        if frame[cell * 3:cell * 3 + 3] != old[cell * 3:cell * 3 + 3]])
+                else:
+                    with stats.timed("dbus.draw"):
+                        draw_frame(self._keyboard.fx.advanced, self._pipeline.apply(compositor.frame), snapshot.cols)
+            except DBusException as e:
+                self._compositor = None
+                self._keyboard = None
+                self._session.connection_lost(f"drawing failed: {e}")
+                return
+            scheme = snapshot.config.get_color_scheme_by_name(entry.scheme_name)
+            if scheme and self._keyboard:
+                self._record_drawn(snapshot, scheme)
+
+    def _on_i3_mode(self, i3_mode_name):
+        """
+        i3 switched to the named mode
+        """
+        with self._draw_lock:
+            snapshot = self._snapshot
+            mode_name = snapshot.i3_modes.get(i3_mode_name.lower())
+            if not mode_name:
+                self._logger.info(f"i3 mode '{i3_mode_name}' has no mode in the config, using '{conf.mode_default}'")
+                mode_name = conf.mode_default
+            if mode_name != self._mode_name:
+                stats.count("mode_switches")
+                self._set_mode(snapshot, mode_name)
+                self._update_color_scheme()
+
+    def _publish(self, snapshot):
+        """
+        makes a completely built snapshot the current one and redraws
+        """
+        with self._draw_lock:
+            self._snapshot = snapshot
+            # cells of the overlays may have moved with a new layout
+            self._compositor = None
+            if self._mode_name and snapshot.get_listen_keys(self._mode_name) is None:
+                self._logger.warning(f"mode {self._mode_name} not in new config, switching to {conf.mode_default}")
+                self._mode_name = conf.mode_default
+            if self._mode_name:
+                self._set_mode(snapshot, self._mode_name)
+            self.force_update_color_scheme()
+
+    def _build_snapshot(self, config=None, layout_name=None, config_file=None):
+        """
+        builds a new snapshot, config and layout default to the ones in the current snapshot
+        config_file: file the config is read from, to find its frame bank
+        """
+        if not config:
+            config = self._snapshot.config
+        if not layout_name:
+            layout_name = self._snapshot.layout_name
+        if self._keyboard:
+            rows, cols = self._keyboard_size()
+        else:
+            # disconnected, keep the size of the last keyboard
+            rows, cols = self._snapshot.rows, self._snapshot.cols
+        bank = None
+        if self._frame_bank:
+            bank = open_bank(config_file or self._config_file, config, layout_name, rows, cols, self._logger)
+        return Snapshot(config, layout_name, layouts[layout_name], rows, cols, self._logger,
+                        switch_keys=not self._i3_ipc, bank=bank)
+
+    def _keyboard_size(self):
+        """
+        rows and cols of the keyboard matrix, saved on this boot with the same daemon or else asked over D-Bus
+        """
+        size = self._state.get_device_size(self._serial, self._session.daemon_owner)
+        if size:
+            return size
+        with stats.timed("dbus.matrix_size"):
+            advanced = self._keyboard.fx.advanced
+            size = advanced.rows, advanced.cols
+        self._state.set_device_size(self._serial, self._session.daemon_owner, *size)
+        return size
+
+    def _draw_color_scheme(self, snapshot, color_config):
         """
         draw the given color scheme
         """
-        if self._current_scheme_name == color_config[conf.field_name]:
+        with self._draw_lock:
+            if self._current_scheme_name == color_config.name:
+                stats.count("draws_skipped_unchanged")
+                return
+            if self._paused:
+                # the scheme is drawn on unlocking
+                stats.count("draws_skipped_paused")
+                return
+            if not self._keyboard:
+                # the current scheme is drawn after reconnecting
+                stats.count("draws_skipped_disconnected")
+                return
+            stats.count("draws_issued")
+            # parse type
+            try:
+                if color_config.type in (conf.type_static, conf.type_heatmap):
+                    self._draw_static_scheme(snapshot, color_config)
+                else:
+                    self._compositor = None
+                    self._draw_color_effect(color_config)
+            except DBusException as e:
+                self._compositor = None
+                self._keyboard = None
+                self._session.connection_lost(f"drawing failed: {e}")
+                return
+
+            self._current_scheme_name = color_config.name
+            self._record_drawn(snapshot, color_config)
+            self._logger.debug("Drawn color scheme '%s'", color_config.name)
+
+    def _record_drawn(self, snapshot, color_config):
+        """
+        remembers the mode and the drawn scheme in the state file, if they changed
+        """
+        drawn = (self._mode_name, color_config.name, self._session.daemon_owner, snapshot, self._pipeline)
+        if drawn == self._recorded_drawn:
             return
-        # parse type
-        if conf.field_type in color_config:
-            if color_config[conf.field_type] == conf.type_static:
-                self._draw_static_scheme(color_config)
-            else:
-                self._draw_color_effect(color_config)
-        else:
-            self._draw_static_scheme(color_config)
+        self._recorded_drawn = drawn
+        self._state.set_drawn(self._serial, self._session.daemon_owner, self._mode_name, color_config.name,
+                              self._scheme_digest(snapshot, color_config))
 
-        self._current_scheme_name = color_config[conf.field_name]
-        self._logger.info(f"Drawn color scheme '{color_config[conf.field_name]}'")
+    def _scheme_digest(self, snapshot, color_config):
+        """
+        checksum of the scheme and the color correction, which the keyboard shows
+        """
+        settings = crc32(repr(self._pipeline.settings()).encode())
+        if color_config.type == conf.type_static:
+            return crc32(snapshot.get_frame(color_config), settings)
+        return crc32(repr(color_config).encode(), settings)
+
+    def _restore_drawn(self):
+        """
+        continues with the mode of the last run and skips the first draw, if the keyboard still shows its scheme
+        """
+        drawn = self._state.get_drawn(self._serial, self._session.daemon_owner)
+        if not drawn:
+            return
+        mode_name, scheme_name, digest = drawn
+        snapshot = self._snapshot
+        if mode_name and not self._i3_ipc and snapshot.get_listen_keys(mode_name) is not None:
+            self._set_mode(snapshot, mode_name)
+        scheme = snapshot.config.get_color_scheme_by_name(scheme_name) if scheme_name else None
+        if scheme and self._scheme_digest(snapshot, scheme) == digest:
+            self._logger.info(f"Keyboard still shows color scheme '{scheme_name}'")
+            self._current_scheme_name = scheme_name
+            if isinstance(scheme, StaticScheme):
+                # the layers of the shown frame, so overlays and later schemes are drawn as differences to it
+                with self._draw_lock:
+                    base = self._get_base_scheme(snapshot, scheme)
+                    compositor = self._compositor = Compositor(snapshot.rows, snapshot.cols)
+                    compositor.set_base(snapshot.get_frame(base))
+                    compositor.set_layer(LAYER_SCHEME, {} if base is scheme else snapshot.get_delta(base, scheme))
+                    self._draw_changed_cells(snapshot,
+                                             compositor.update_layer(LAYER_OVERLAY, self._overlay_cells(snapshot)))
 
     def _draw_color_effect(self, color_config):
         """
         Draw an effect color scheme
         """
-        if conf.field_type not in color_config:
-            return
-        effect_type = color_config[conf.field_type]
+        effect_type = color_config.type
         fx = self._keyboard.fx
 
         # find colors for effect
-        color1, color2, color3 = None, None, None
-        nr_colors = 0
-        if conf.type_color in color_config:
-            color1 = self._config.get_color(color_config[conf.type_color])
-            nr_colors = 1
-        elif conf.type_color1 in color_config:
-            color1 = self._config.get_color(color_config[conf.type_color1])
-            nr_colors = 1
-            if conf.type_color2 in color_config:
-                color2 = self._config.get_color(color_config[conf.type_color2])
-                nr_colors = 2
-                if conf.type_color3 in color_config:
-                    color3 = self._config.get_color(color_config[conf.type_color3])
-                    nr_colors = 3
+        colors = [self._pipeline.apply_color(tuple(color)) for color in color_config.colors]
+        nr_colors = len(colors)
+        color1, color2, color3 = colors + [None] * (3 - nr_colors)
 
         # huge switch through all modes -----------------------------------------------------------------
+        with stats.timed("dbus.effect"):
+            self._call_color_effect(fx, effect_type, color_config, nr_colors, color1, color2, color3)
+
+    def _call_color_effect(self, fx, effect_type, color_config, nr_colors, color1, color2, color3):
+        """
+        Calls the openrazer function for the effect
+        """
         # breath
         if effect_type == conf.type_breath:
             if nr_colors >= 3 and fx.has("breath_triple"):
@@ -129,14 +439,13 @@ class I3Razer:
         # reactive
         elif effect_type == conf.type_reactive:
             if not fx.has("reactive"):
-                self._logger.warning(f"reactive not supported by keyboard {self._keyboard.name}")
+                self._log_limit.warning("reactive not supported by keyboard %s", self._keyboard.name)
                 return
             if not color1:
-                self._logger.warning(f"No color for reactive set in {color_config[conf.field_name]}")
+                self._log_limit.warning("No color for reactive set in %s", color_config.name,
+                                        key=("no reactive color", color_config.name))
                 return
-            time = conf.time_r_default
-            if conf.type_option_time in color_config:
-                time = color_config[conf.type_option_time]
+            time = color_config.time or conf.time_r_default
             razer_time = razer_constants.REACTIVE_500MS if time == conf.time_500 \
                 else razer_constants.REACTIVE_1000MS if time == conf.time_1000 \
                 else razer_constants.REACTIVE_1500MS if time == conf.time_1500 \
@@ -147,7 +456,7 @@ class I3Razer:
         # ripple
         elif effect_type == conf.type_ripple:
             if not fx.has("ripple"):
-                self._logger.warning(f"ripple not supported by keyboard {self._keyboard.name}")
+                self._log_limit.warning("ripple not supported by keyboard %s", self._keyboard.name)
                 return
             if color1:
                 fx.ripple(color1[0], color1[1], color1[2], razer_constants.RIPPLE_REFRESH_RATE)
@@ -157,15 +466,13 @@ class I3Razer:
         # spectrum
         elif effect_type == conf.type_spectrum:
             if not fx.has("spectrum"):
-                self._logger.warning(f"spectrum not supported by keyboard {self._keyboard.name}")
+                self._log_limit.warning("spectrum not supported by keyboard %s", self._keyboard.name)
                 return
             fx.spectrum()
 
         # starlight
         elif effect_type == conf.type_starlight:
-            time = conf.time_s_default
-            if conf.type_option_time in color_config:
-                time = color_config[conf.type_option_time]
+            time = color_config.time or conf.time_s_default
             razer_time = razer_constants.STARLIGHT_FAST if time == conf.time_fast \
                 else razer_constants.STARLIGHT_NORMAL if time == conf.time_normal \
                 else razer_constants.STARLIGHT_SLOW if time == conf.time_slow \
@@ -186,111 +493,169 @@ class I3Razer:
             fx.wave(razer_constants.WAVE_LEFT)
 
         else:
-            self._logger.warning(f"type '{effect_type}' is not known")
+            self._log_limit.warning("type '%s' is not known", effect_type, key=("unknown type", effect_type))
 
         # switch finished
 
-    def _draw_static_scheme(self, color_config):
+    def _draw_static_scheme(self, snapshot, color_config):
         """
-        draw a static color scheme
+        draw a static color scheme from its prerendered frame
+        The default scheme of the mode is the base layer, other schemes are composed on it as difference,
+        so only the keys which differ from the shown frame are set
         """
-        # One could save the result matrix to be faster on a following draw
-        self._keyboard.fx.advanced.matrix.reset()
-        self._add_to_static_scheme(color_config)
-        self._keyboard.fx.advanced.draw()
+        compositor = self._compositor
+        full_draw = not compositor or (compositor.rows, compositor.cols) != (snapshot.rows, snapshot.cols)
+        if full_draw:
+            compositor = self._compositor = Compositor(snapshot.rows, snapshot.cols)
+            compositor.set_layer(LAYER_OVERLAY, self._overlay_cells(snapshot))
+        shown = None if full_draw or not self._fade or not self._animator else bytes(compositor.frame)
+        if isinstance(color_config, HeatmapScheme):
+            # rendered on each draw, as the counts change
+            base_frame, delta = self._render_heatmap(snapshot, color_config), {}
+        else:
+            base_config = self._get_base_scheme(snapshot, color_config)
+            base_frame = snapshot.get_frame(base_config)
+            delta = {} if base_config is color_config else snapshot.get_delta(base_config, color_config)
+        changed = compositor.set_base(base_frame)
+        changed |= compositor.set_layer(LAYER_SCHEME, delta)
+        if shown is not None and changed:
+            # fade the changed cells from the shown colors to the ones of the new scheme
+            target = compositor.get_composite(LAYER_SCHEME)
+            cells = [cell for cell in range(snapshot.rows * snapshot.cols)
+                     if shown[cell * 3:cell * 3 + 3] != target[cell * 3:cell * 3 + 3]]
+            self._animator.add(Fade(shown, target, cells, self._fade, self._fps), "fade")
+            changed = compositor.set_layer(LAYER_ANIMATION, self._animator.current_cells())
+
+        advanced = self._keyboard.fx.advanced
+        with stats.timed("dbus.draw"):
+            if full_draw:
+                draw_frame(advanced, self._pipeline.apply(compositor.frame), snapshot.cols)
+            elif changed:
+                draw_cells(advanced, self._pipeline.apply(compositor.frame), snapshot.cols, changed)
+            else:
+                stats.count("draws_skipped_same_frame")
 
-    def _add_to_static_scheme(self, color_config):
+    def _render_heatmap(self, snapshot, color_config):
         """
-        Adds inherited color schemes on display matrix
+        returns the frame of a heatmap color scheme with the current counts
         """
-        # assert scheme type is static
-        if color_config[conf.field_type] != conf.type_static:
-            self._logger.warning(f"trying to inherit a non static color scheme '{color_config[conf.field_name]}")
-            return
-
-        # handle infinite loop
-        name = color_config[conf.field_name]
-        if name in self._drawing_scheme:
-            # should be detected on reading config
-            self._logger.warning(f"color scheme '{name}' is in an inherit loop with {self._drawing_scheme}")
-            return
-        self._drawing_scheme.add(name)
-
-        # set colors
-        for field in color_config:
-            # handle "inherit
-            if field == conf.field_inherit:
-                add_scheme = self._config.get_color_scheme_by_name(color_config[conf.field_inherit])
-                self._add_to_static_scheme(add_scheme)
-                continue
-
-            # non color fields
-            if field in conf.no_color_in_scheme:
-                continue
-
-            # handle "all"
-            if field == conf.all_keys:
-                keys = self._key_layout.keys()
-            else:
-                # field is a key array
-                keys = self._config.get_keys(field)
-            if keys:
-                color = self._config.get_color(color_config[field])
-                self._set_color(color, keys)
+        counts = self._usage.get_counts(color_config.mode) if self._usage else {}
+        with stats.timed("render.heatmap"):
+            return bytes(render_heatmap(snapshot.layout, snapshot.rows, snapshot.cols, counts, color_config.ramp))
 
-        self._drawing_scheme.remove(name)
+    def _on_animation_frame(self, cells):
+        """
+        the animator shows the next frame of the running animations
+        """
+        snapshot = self._snapshot
+        with self._draw_lock:
+            if self._compositor and self._running:
+                self._draw_changed_cells(snapshot, self._compositor.set_layer(LAYER_ANIMATION, cells))
 
-    def _set_color(self, color, keys):
-        for key in keys:
-            if key in self._key_layout:
-                self._keyboard.fx.advanced.matrix[self._key_layout[key]] = color
-            else:
-                self._logger.warning(f"Key '{key}' not found in Layout")
+    def _get_base_scheme(self, snapshot, color_config):
+        """
+        returns the default scheme of the current mode if it is static, otherwise the given scheme
+        """
+        mode = snapshot.config.get_mode_by_name(self.get_mode_name())
+        base_config = snapshot.config.get_color_scheme_by_name(mode.scheme) if mode else None
+        if isinstance(base_config, StaticScheme):
+            return base_config
+        return color_config
 
     def _load_keyboard(self, layout):
         """
         Load Keyboard on startup
         """
         self._key_layout_name = layout
-        if not self.reload_keyboard():
+        if not self._session.connect(CONNECT_TIMEOUT):
+            if not self._session.daemon_running:
+                self._logger.critical("Openrazer daemon not running")
+                exit(ERR_DAEMON_OFF)
             self._logger.critical("No Razer Keyboard found")
             exit(ERR_NO_KEYBOARD)
+        self.reload_keyboard()
+        self._session.listen_for_changes()
 
-    def _setup_key_hook(self):
+    def _open_session(self):
+        self._session = DeviceSession(self._logger)
+        self._session.OnConnect = self._on_reconnect
+
+    def _reopen_session(self):
         """
-        Setup pyxhook to recognize key presses
+        stop() closed the session, which does not reconnect and watch the daemon anymore: continue with a new one
         """
+        self._open_session()
+        if self._session.connect():
+            self._keyboard = self._session.keyboard
+            self._serial = self._session.serial
+        else:
+            self._keyboard = None
+            self._session.connection_lost("keyboard not found on restart")
+        self._session.listen_for_changes()
 
-        def on_key_pressed(event):
-            # Key pressed, update scheme if needed
-            key = event.Key.lower()  # config is in lower case
-            if key not in self._current_pressed_keys:
-                self._current_pressed_keys.add(key)
-                if key in self._listen_to_keys:
-                    self._update_color_scheme()
+    def _load_color_correction(self, brightness, gamma):
+        """
+        uses the color correction saved for the keyboard, changed by the given values
+        """
+        saved = self._state.get_color_correction(self._serial)
+        if saved:
+            try:
+                self._pipeline = ColorPipeline(**saved)
+            except (TypeError, ValueError) as e:
+                self._logger.warning(f"Ignoring saved color correction: {e}")
+        self._pipeline = self._pipeline.replace(brightness, gamma)
 
-        def on_key_released(event):
-            key = event.Key.lower()
-            if key in self._current_pressed_keys:
-                self._current_pressed_keys.remove(key)
-            else:
-                self._logger.warning(
-                    f"releasing key {key} not in pressed keys {self._current_pressed_keys}, resetting pressed keys")
-                self._current_pressed_keys = set()
-            if key in self._listen_to_keys:
-                self._update_color_scheme()
+    def _on_reconnect(self, keyboard):
+        """
+        the session found the keyboard again, redraw the current scheme
+        """
+        self._keyboard = keyboard
+        self._serial = self._session.serial
+        self._compositor = None  # the keyboard may not show the old frame anymore
+        if not self._snapshot:
+            return
+        advanced = keyboard.fx.advanced
+        if (advanced.rows, advanced.cols) != (self._snapshot.rows, self._snapshot.cols):
+            # another keyboard was plugged in
+            self._publish(self._build_snapshot())
+        else:
+            self.force_update_color_scheme()
+
+    def _setup_key_hook(self, hook=None):
+        """
+        Setup pyxhook to recognize key presses
+        hook: alternative event source with the HookManager interface, e.g. a ReplayHook
+        """
+
+        def on_key_event(event):
+            # A key relevant in the current mode was pressed or released, or the hook read the pressed keys again.
+            # The hook tracks the pressed state of all keys, irrelevant keys are not handed to this function
+            pressed_keys = self._hook.pressed_keys()  # config is in lower case
+            if pressed_keys == self._current_pressed_keys:
+                # key repeat
+                stats.count("events_ignored")
+                return
+            self._current_pressed_keys = pressed_keys
+            self._update_color_scheme()
 
         # init hook manager
-        hook = HookManager()
-        hook.KeyDown = on_key_pressed
-        hook.KeyUp = on_key_released
+        if not hook:
+            hook = HookManager()
+        if self._usage:
+            hook.usage = self._usage
+            self._usage.keycode_name = hook.keycode_name
+        hook.KeyDown = on_key_event
+        hook.KeyUp = on_key_event
+        hook.OnResync = lambda: on_key_event(None)
         self._hook = hook
+        hook.set_relevant_keys(set())  # relevant keys are set with the mode
 
     def _load_config(self, config_file):
         """
-        Load config on startup
+        Load config on startup, the snapshot is built when the keyboard is loaded
         """
-        self._config = ConfigParser(config_file, self._logger)
+        self._config_file = config_file
+        self._config = ConfigParser(config_file, self._logger, all_modes_reachable=bool(self._i3_ipc))
         if not self._config.is_integral():
             self._logger.critical("Error while loading config file")
             exit(ERR_CONFIG)
@@ -299,17 +664,56 @@ class I3Razer:
     # public methods to change or query the state #
     ###############################################
 
-    def start(self):
+    def start(self, hook=None):
         """
         Start the shortcut visualisation. This starts a new Thread.
         Stop this by calling stop() on the object.
+        hook: event source to use instead of a new HookManager, e.g. a ReplayHook to replay a record file
         """
         if not self._running:
             self._logger.warning("Starting Hook")
-            self._setup_key_hook()
+            if self._session.closed:
+                self._reopen_session()
+            self._setup_key_hook(hook)
+            if self._status_file:
+                try:
+                    self._status = StatusExport(self._status_file if isinstance(self._status_file, str) else None)
+                except OSError as e:
+                    self._logger.error(f"Cannot export the status: {e}")
+            # keys held while starting
+            self._hook.resync()
+            self._current_pressed_keys = self._hook.pressed_keys()
             self._hook.start()
+            if self._usage:
+                self._usage.start_flushing()
             self._running = True
+            self._restore_drawn()
             self._update_color_scheme()
+            if self._i3_ipc:
+                socket_path = self._i3_ipc if isinstance(self._i3_ipc, str) else None
+                self._i3_listener = I3ModeListener(socket_path)
+                self._i3_listener.OnMode = self._on_i3_mode
+                self._i3_listener.start()
+            if self._watch_config:
+                self._config_watcher = ConfigWatcher(self._snapshot.config.get_files(), logger=self._logger)
+                self._config_watcher.OnChange = self._on_config_changed
+                self._config_watcher.start()
+            self._animator = Animator(self._fps, self._logger)
+            self._animator.OnFrame = self._on_animation_frame
+            self._animator.start()
+            if self._watch_lock:
+                self._lock_watcher = LockWatcher(self._lock_command, logger=self._logger)
+                self._lock_watcher.OnLock = self._on_lock
+                self._lock_watcher.OnUnlock = self._on_unlock
+                self._lock_watcher.start()
+            if self._control_socket:
+                socket_path = self._control_socket if isinstance(self._control_socket, str) else None
+                try:
+                    self._control = ControlServer(self, socket_path, self._logger)
+                    self._control.start()
+                except OSError as e:
+                    self._logger.error(f"Control interface not available: {e}")
+                    self._control = None
 
     def stop(self):
         """
@@ -320,42 +724,119 @@ class I3Razer:
             self._running = False
             self._hook.cancel()
             self._hook = None
+            if self._i3_listener:
+                self._i3_listener.cancel()
+                self._i3_listener = None
+            if self._config_watcher:
+                self._config_watcher.cancel()
+                self._config_watcher = None
+            if self._control:
+                self._control.cancel()
+                self._control = None
+            if self._lock_watcher:
+                self._lock_watcher.cancel()
+                self._lock_watcher = None
+            self.remove_overlay()
+            self._animator.cancel()
+            self._animator = None
+            if self._status:
+                self._status.close()
+                self._status = None
+            if self._usage:
+                self._usage.stop_flushing()
+            self._session.close()
+            self._state.save()
+
+    def _on_lock(self):
+        """
+        the screen was locked: shows the lock scheme, then the hook only tracks the pressed keys and nothing is drawn
+        """
+        if self._hook:
+            self._hook.set_paused(True)
+        if self._animator:
+            self._animator.set_paused(True)
+        snapshot = self._snapshot
+        with self._draw_lock:
+            if self._lock_scheme == LOCK_OFF:
+                if self._keyboard:
+                    try:
+                        with stats.timed("dbus.draw"):
+                            draw_frame(self._keyboard.fx.advanced, new_frame(snapshot.rows, snapshot.cols),
+                                       snapshot.cols)
+                    except DBusException as e:
+                        self._keyboard = None
+                        self._session.connection_lost(f"drawing failed: {e}")
+                self._compositor = None
+                self._current_scheme_name = ""
+            elif self._lock_scheme:
+                scheme = snapshot.config.get_color_scheme_by_name(self._lock_scheme)
+                if scheme:
+                    # drawn as a whole, without fading or animations
+                    self._compositor = None
+                    self._draw_color_scheme(snapshot, scheme)
+            self._paused = True
+
+    def _on_unlock(self):
+        """
+        the screen was unlocked: continues with the keys pressed now and draws the current scheme once
+        """
+        with self._draw_lock:
+            self._paused = False
+            # overlays and animations may have changed meanwhile
+            self._compositor = None
+        if self._hook:
+            self._hook.set_paused(False)
+            self._hook.resync()
+            self._current_pressed_keys = self._hook.pressed_keys()
+        if self._animator:
+            self._animator.set_paused(False)
+        self.force_update_color_scheme()
+
+    def _on_config_changed(self):
+        """
+        a config file was saved, called in the thread of the watcher
+        """
+        watcher = self._config_watcher
+        self.reload_config()
+        if watcher:
+            # the files of the current config and the ones of a failed reload, e.g. a new include with errors
+            watcher.set_files(set(self._snapshot.config.get_files()) | set(self._tried_config_files))
 
     def reload_config(self, config_file=None) -> bool:
         """
         Loads a new config file and updates color_scheme accordingly
+        The new config is read and prerendered completely, before it replaces the old one
         return: False if error in config
         """
-        if not self._config.read(config_file):
-            self._logger.error(f"Error in config, using old config file")
-            return False
-        self.force_update_color_scheme()
+        if not config_file:
+            config_file = self._config_file
+        with stats.timed("config.reload"):
+            config = ConfigParser(config_file, self._logger, all_modes_reachable=bool(self._i3_ipc))
+            self._tried_config_files = config.get_files()
+            if not config.is_integral():
+                stats.count("config_reloads_failed")
+                self._logger.error(f"Error in config, using old config file")
+                return False
+            snapshot = self._build_snapshot(config=config, config_file=config_file)
+        self._config_file = config_file
+        stats.count("config_reloads")
+        self._publish(snapshot)
         return True
 
     def reload_keyboard(self, layout=None) -> bool:
         """
         Reloads to the computer connected keyboards, and could set an layout
+        The connection of the session is reused, the daemon is only enumerated again if the keyboard is gone
         return: true if a razer keyboard was loaded
         """
-        try:
-            device_manager = DeviceManager()
-        except DaemonNotFound:
-            self._logger.critical("Openrazer daemon not running")
-            exit(ERR_DAEMON_OFF)
-        for device in device_manager.devices:
-            if device.type == "keyboard":
-                self._keyboard = device
-                break
-
-        if self._keyboard:
-            if layout:
-                self._key_layout_name = layout
-            device_manager.sync_effects = False
-            self._serial = str(self._keyboard.serial)
-            self.load_layout(self._key_layout_name)
-        else:
+        if not self._session.connect():
             self._logger.error("no razer keyboard found")
             return False
+        self._keyboard = self._session.keyboard
+        self._serial = self._session.serial
+        if layout:
+            self._key_layout_name = layout
+        self.load_layout(self._key_layout_name)
         self._logger.info(f"successfully loaded Keyboard {self._keyboard.name}")
         return True
 
@@ -372,37 +853,90 @@ class I3Razer:
         if not layout_name:
             no_layout = True
             if self._keyboard:
-                layout_name = self._keyboard.keyboard_layout
-                self._logger.info(f"Detected Layout {layout_name}")
-        if layout_name not in layouts and no_layout:
+                facts = self._state.get_device(self._serial)
+                if facts and facts.get("layout"):
+                    layout_name = facts["layout"]
+                    self._logger.info(f"Using saved Layout {layout_name}")
+                else:
+                    with stats.timed("dbus.keyboard_layout"):
+                        layout_name = self._keyboard.keyboard_layout
+                    self._logger.info(f"Detected Layout {layout_name}")
+                    self._remember_keyboard(layout_name)
+        if layout_name not in layouts and (no_layout or not self._snapshot):
+            # without a snapshot there is no old layout to keep
             self._logger.error(f"Layout {layout_name} not found, using default 'en_US'")
             layout_name = "en_US"  # en_US is default and in layout.py
 
         if layout_name in layouts:
             # Load the layout
-            self._key_layout = layouts[layout_name]
+            if self._snapshot:
+                self._publish(self._build_snapshot(layout_name=layout_name))
+            else:
+                # first load
+                self._snapshot = self._build_snapshot(config=self._config, layout_name=layout_name)
+                self._config = None
             self._logger.info(f"Loaded keyboard layout {layout_name}")
             return True
+        return False
+
+    def _remember_keyboard(self, layout_name):
+        """
+        saves the detected layout of the keyboard, so it needs no D-Bus query on the next start
+        the size is saved when the snapshot is built
+        """
+        self._state.set_device(self._serial, {"name": self._keyboard.name, "layout": layout_name})
 
     def change_mode(self, mode_name: str) -> bool:
         """
         changes the current mode to the given one and updates the scheme
         return: False if mode does not exist in config
         """
-        new_mode = _mode = self._config.get_mode_by_name(mode_name)
-        if new_mode:
-            self._mode = new_mode
-            self._listen_to_keys = self._config.get_important_keys_mode(self._mode)
+        snapshot = self._snapshot
+        if not snapshot.config.get_mode_by_name(mode_name):
+            return False
+        with self._draw_lock:
+            self._set_mode(snapshot, mode_name)
             self._update_color_scheme()
-            return True
-        return False
+        return True
+
+    def push_mode(self, mode_name: str) -> bool:
+        """
+        changes to the given mode like change_mode, the current mode is put on the mode stack to return to it
+        with pop_mode()
+        return: False if mode does not exist in config
+        """
+        snapshot = self._snapshot
+        mode = snapshot.config.get_mode_by_name(mode_name)
+        if not mode:
+            return False
+        with self._draw_lock:
+            self._push_mode(snapshot, snapshot.config.get_mode_by_name(self.get_mode_name()), mode)
+            self._update_color_scheme()
+        return True
+
+    def pop_mode(self) -> bool:
+        """
+        returns to the mode on top of the mode stack
+        return: False if the stack is empty
+        """
+        with self._draw_lock:
+            if not self._pop_mode(self._snapshot):
+                return False
+            self._update_color_scheme()
+        return True
+
+    def get_mode_stack(self) -> list:
+        """
+        returns the names of the modes on the mode stack, the mode pop_mode() returns to last
+        """
+        return self._mode_stack.names()
 
     def get_mode_name(self) -> str:
         """
         returns the name of the current mode
         """
-        if self._mode:
-            return self._mode[conf.field_name]
+        if self._mode_name:
+            return self._mode_name
         else:
             # if no mode loaded, return default name
             return conf.mode_default
@@ -413,12 +947,186 @@ class I3Razer:
         Works also if the thread is not started yet, then the scheme does not change on a keypress
         return: false if the color scheme cannot be found
         """
-        color_config = self._config.get_color_scheme_by_name(color_scheme_name)
+        snapshot = self._snapshot
+        color_config = snapshot.config.get_color_scheme_by_name(color_scheme_name)
         if not color_config:
             return False
-        self._draw_color_scheme(color_config)
+        self._draw_color_scheme(snapshot, color_config)
+        self._export_status()
+        return True
+
+    def show_overlay(self, keys, color, timeout=None) -> int:
+        """
+        lights the keys in the color on top of the current color scheme, without changing the scheme.
+        Only the keys of the overlay are set on the keyboard. Later overlays are shown above earlier ones.
+        keys: key array of the config (e.g. 'w, a, s, d' or a keyset name) or iterable of key names
+        color: (r, g, b), a color name of the config or '0xrrggbb'
+        timeout: seconds until the overlay is removed, None to keep it until remove_overlay()
+        return: id of the overlay, 0 if the keys or the color are not known
+        """
+        snapshot = self._snapshot
+        keys = self._resolve_keys(snapshot, keys)
+        color = self._resolve_color(snapshot, color)
+        if not keys or not color:
+            return 0
+        with self._draw_lock:
+            overlay_id = self._next_overlay_id
+            self._next_overlay_id += 1
+            timer = None
+            if timeout is not None:
+                timer = threading.Timer(timeout, self.remove_overlay, (overlay_id,))
+                timer.daemon = True
+            self._overlays[overlay_id] = (keys, bytes(color), timer)
+            cells = dict.fromkeys(snapshot.get_cells(keys), bytes(color))
+            if self._compositor:
+                self._draw_changed_cells(snapshot, self._compositor.update_layer(LAYER_OVERLAY, cells))
+            if timer:
+                timer.start()
+        stats.count("overlays_shown")
+        return overlay_id
+
+    def remove_overlay(self, overlay_id=None) -> bool:
+        """
+        removes the overlay and shows again what is below it, all overlays if no id is given
+        return: False if there is no such overlay
+        """
+        snapshot = self._snapshot
+        with self._draw_lock:
+            if overlay_id is None:
+                removed = list(self._overlays)
+            elif overlay_id in self._overlays:
+                removed = [overlay_id]
+            else:
+                return False
+            removed_keys = set()
+            for removed_id in removed:
+                keys, _, timer = self._overlays.pop(removed_id)
+                if timer:
+                    timer.cancel()
+                removed_keys.update(keys)
+            if self._compositor:
+                # cells of other overlays below the removed one show their color again
+                cells = snapshot.get_cells(removed_keys)
+                remaining = self._overlay_cells(snapshot, cells)
+                changed = self._compositor.update_layer(LAYER_OVERLAY, remaining,
+                                                        remove=[cell for cell in cells if cell not in remaining])
+                self._draw_changed_cells(snapshot, changed)
         return True
 
+    def _overlay_cells(self, snapshot, only_cells=None):
+        """
+        returns the cells of all overlays, the latest overlay wins. only_cells: restrict to these cells
+        """
+        cells = {}
+        for keys, color, _ in self._overlays.values():
+            for cell in snapshot.get_cells(keys):
+                if only_cells is None or cell in only_cells:
+                    cells[cell] = color
+        return cells
+
+    def _draw_changed_cells(self, snapshot, changed):
+        """
+        sends the changed cells of the composed frame to the keyboard
+        """
+        if not changed or not self._keyboard or self._paused:
+            return
+        try:
+            with stats.timed("dbus.draw_cells"):
+                draw_cells(self._keyboard.fx.advanced, self._pipeline.apply(self._compositor.frame), snapshot.cols,
+                           changed)
+        except DBusException as e:
+            self._compositor = None
+            self._keyboard = None
+            self._session.connection_lost(f"drawing failed: {e}")
+
+    def pulse_keys(self, keys, color, period=1.0, timeout=None) -> int:
+        """
+        lets the keys glow up in the color and fade out again, once per period seconds.
+        keys, color, timeout: see show_overlay
+        return: id of the animation, 0 if the keys or the color are not known or the animations are not started
+        """
+        snapshot = self._snapshot
+        cells = snapshot.get_cells(self._resolve_keys(snapshot, keys))
+        color = self._resolve_color(snapshot, color)
+        if not cells or not color or not self._animator:
+            return 0
+        return self._animator.add(Pulse(cells, color, period, self._fps, timeout))
+
+    def gradient_keys(self, keys, color1, color2, period=2.0, timeout=None) -> int:
+        """
+        shows a gradient between the two colors over the keys, moving from left to right once per period seconds
+        keys, color1, color2, timeout: see show_overlay
+        return: id of the animation, 0 if the keys or the colors are not known or the animations are not started
+        """
+        snapshot = self._snapshot
+        cells = snapshot.get_cells(self._resolve_keys(snapshot, keys))
+        color1 = self._resolve_color(snapshot, color1)
+        color2 = self._resolve_color(snapshot, color2)
+        if not cells or not color1 or not color2 or not self._animator:
+            return 0
+        return self._animator.add(Gradient(cells, snapshot.cols, color1, color2, period, self._fps, timeout))
+
+    def stop_animation(self, animation_id=None) -> bool:
+        """
+        stops the animation, all if no id is given
+        return: False if there is no such animation
+        """
+        return bool(self._animator) and self._animator.remove(animation_id)
+
+    @staticmethod
+    def _resolve_color(snapshot, color):
+        """
+        returns the (r, g, b) of a color name of the config, '0xrrggbb' or (r, g, b), None if unknown
+        """
+        if isinstance(color, str):
+            return snapshot.config.get_color(color.lower())
+        return color
+
+    @staticmethod
+    def _resolve_keys(snapshot, keys):
+        """
+        returns the set of key names of a key array of the config or an iterable of key names
+        """
+        if isinstance(keys, str):
+            keys = keys.lower().split(conf.del_array)
+        resolved = set()
+        for key in keys:
+            key = key.strip().lower()
+            if key == conf.all_keys:
+                resolved.update(snapshot.layout)
+            elif key:
+                resolved.update(snapshot.config.get_keys(key))
+        return resolved
+
+    def set_color_correction(self, brightness=None, gamma=None, white_balance=None):
+        """
+        changes the color correction of the keyboard, see ColorPipeline. None keeps the current value.
+        Only the lookup tables are computed again, the shown frame is corrected and sent once
+        raises ValueError for invalid values
+        """
+        pipeline = self._pipeline.replace(brightness, gamma, white_balance)
+        with self._draw_lock:
+            self._pipeline = pipeline
+            self._state.set_color_correction(self._serial, pipeline.settings())
+            snapshot = self._snapshot
+            if self._compositor and self._keyboard:
+                try:
+                    with stats.timed("dbus.draw"):
+                        draw_frame(self._keyboard.fx.advanced, pipeline.apply(self._compositor.frame), snapshot.cols)
+                except DBusException as e:
+                    self._compositor = None
+                    self._keyboard = None
+                    self._session.connection_lost(f"drawing failed: {e}")
+            elif self._keyboard:
+                # an effect is shown, draw it with the new colors
+                self.force_update_color_scheme()
+
+    def get_color_correction(self) -> dict:
+        """
+        returns the brightness, gamma and white balance
+        """
+        return self._pipeline.settings()
+
     def get_color_scheme_name(self) -> str:
         """
         returns the current drawn color scheme
@@ -429,5 +1137,6 @@ class I3Razer:
         """
         deletes internal variables and detects which color scheme to show
         """
-        self._current_scheme_name = ""
-        self._update_color_scheme()
+        with self._draw_lock:
+            self._current_scheme_name = ""
+            self._update_color_scheme()
@@ -0,0 +1,149 @@
+"""
+Base class for the key event sources (HookManager, ReplayHook)
+"""
+import threading
+from abc import ABCMeta, abstractmethod
+from logging import getLogger
+
+from i3razer.log_limit import LogLimiter
+from i3razer.stats import stats
+
+
+class KeyHook(threading.Thread, metaclass=ABCMeta):
+    """
+    Keeps track of the pressed keys and decides which events are handed to KeyDown and KeyUp.
+    Keys are identified by their keycode, subclasses resolve keycodes to key names in keycode_name().
+
+    If relevant keys are set with set_relevant_keys(), events of other keys only update the pressed state.
+    They do not create an event object and do not call KeyDown / KeyUp.
+    While paused (e.g. the screen is locked) no event is dispatched, counted or recorded, only the pressed state
+    is kept.
+    If events were missed (a key is released which is not pressed), the pressed state is read again from the
+    keyboard with query_pressed(), if the subclass can do this.
+
+    OnResync    : called when resync() changed the pressed state outside of a key event, e.g. after a grab
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.finished = threading.Event()
+        self.KeyDown = lambda x: True
+        self.KeyUp = lambda x: True
+        self.OnResync = lambda: True
+
+        self._pressed = set()  # keycodes of the pressed keys
+        self._relevant = None  # keycodes to dispatch events for, None: all keys
+        self._relevant_names = None
+        self._keycode_names = {}  # keycode: lower case key name
+        self.usage = None  # KeyUsage counting the presses
+        self.paused = False
+        self._log_limit = LogLimiter(getLogger(__name__))
+
+    @abstractmethod
+    def keycode_name(self, keycode) -> str:
+        """
+        returns the key name for the keycode
+        """
+
+    def query_pressed(self):
+        """
+        returns the keycodes the keyboard reports as pressed at the moment, None if the source cannot tell
+        """
+        return None
+
+    def resync(self) -> bool:
+        """
+        replaces the pressed state with the one of query_pressed()
+        return: True if the pressed state changed
+        """
+        pressed = self.query_pressed()
+        if pressed is None:
+            return False
+        stats.count("pressed_resyncs")
+        pressed = set(pressed)
+        if pressed == self._pressed:
+            return False
+        self._pressed = pressed
+        return True
+
+    def _lower_keycode_name(self, keycode):
+        name = self._keycode_names.get(keycode)
+        if name is None:
+            name = self._keycode_names[keycode] = self.keycode_name(keycode).lower()
+        return name
+
+    def set_relevant_keys(self, key_names):
+        """
+        only events of the named keys (lower case) are dispatched, None dispatches all events
+        """
+        self._relevant_names = key_names
+        if key_names is None:
+            self._relevant = None
+        else:
+            self._relevant = frozenset(keycode for keycode in range(8, 256)
+                                       if self._lower_keycode_name(keycode) in key_names)
+
+    def pressed_keys(self) -> set:
+        """
+        returns the lower case names of all currently pressed keys
+        """
+        return {self._lower_keycode_name(keycode) for keycode in self._pressed.copy()}
+
+    def reset_keysyms(self):
+        """
+        the keycode to key name mapping changed, e.g. because the keyboard layout changed
+        """
+        self._keycode_names = {}
+        self.set_relevant_keys(self._relevant_names)
+
+    def set_paused(self, paused):
+        """
+        paused: True -> only the pressed state is tracked, see class description
+        """
+        self.paused = paused
+
+    def _press(self, keycode) -> bool:
+        """
+        updates the pressed state, returns True if the event should be dispatched
+        """
+        if self.paused:
+            self._pressed.add(keycode)
+            return False
+        stats.count("events_seen")
+        usage = self.usage
+        if usage is not None and keycode not in self._pressed:
+            # key repeats are not counted
+            usage.count(keycode)
+        self._pressed.add(keycode)
+        relevant = self._relevant
+        if relevant is None or keycode in relevant:
+            return True
+        stats.count("events_ignored")
+        return False
+
+    def _release(self, keycode) -> bool:
+        """
+        updates the pressed state, returns True if the event should be dispatched
+        """
+        if self.paused:
+            self._pressed.discard(keycode)
+            return False
+        stats.count("events_seen")
+        if keycode in self._pressed:
+            self._pressed.remove(keycode)
+        else:
+            # events were missed, e.g. during a VT switch. Dispatched in any case, as other keys may have changed
+            self._log_limit.warning("releasing keycode %d which is not pressed, reading the pressed keys", keycode)
+            pressed = self.query_pressed()
+            if pressed is None:
+                stats.count("pressed_resets")
+                self._pressed.clear()
+            else:
+                stats.count("pressed_resyncs")
+                self._pressed = set(pressed)
+            return True
+        relevant = self._relevant
+        if relevant is None or keycode in relevant:
+            return True
+        stats.count("events_ignored")
+        return False
@@ -0,0 +1,125 @@
+"""
+Notices when the screen is locked or the screen saver is active, to pause the key handling and drawing meanwhile
+"""
+import os
+import select
+import subprocess
+import threading
+from logging import getLogger
+
+from i3razer.stats import stats
+
+
+class LockWatcher(threading.Thread):
+    """
+    Watches the lock state and calls OnLock / OnUnlock when it changes.
+    Sources of the lock state, the screen counts as locked if one of them says so:
+        MIT-SCREEN-SAVER extension of the X server: its notify events are waited for, nothing is polled
+        lock_command: shell command run every poll_interval seconds, exit status 0 means locked
+            (e.g. 'pgrep -x i3lock')
+
+    OnLock      : called without arguments in the thread of the watcher
+    OnUnlock    : called without arguments in the thread of the watcher
+    """
+
+    def __init__(self, lock_command=None, poll_interval=2.0, screensaver=True, logger=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.name = "i3razer-lock"
+        if not logger:
+            logger = getLogger(__name__)
+        self._logger = logger
+        self.lock_command = lock_command
+        self.poll_interval = poll_interval
+        self.finished = threading.Event()
+        self.OnLock = lambda: True
+        self.OnUnlock = lambda: True
+        self.locked = False
+
+        self._saver_active = False
+        self._command_locked = False
+        self._display = None
+        self._saver_event = None  # event type of ScreenSaverNotify
+        if screensaver:
+            self._open_screensaver()
+        self._wake_read, self._wake_write = os.pipe()  # wakes the poll on cancel
+
+    def _open_screensaver(self):
+        try:
+            from Xlib import display
+            from Xlib.ext import screensaver
+            self._display = display.Display()
+            if not self._display.has_extension(screensaver.extname):
+                self._logger.debug("X server has no MIT-SCREEN-SAVER extension")
+                self._display.close()
+                self._display = None
+                return
+            root = self._display.screen().root
+            root.screensaver_select_input(screensaver.NotifyMask)
+            self._saver_event = self._display.query_extension(screensaver.extname).first_event
+            self._saver_active = root.screensaver_query_info().state == screensaver.StateOn
+            self._display.flush()
+        except Exception as e:
+            self._logger.debug(f"Screen saver state not available: {e}")
+            self._display = None
+
+    def _read_screensaver(self):
+        from Xlib.ext import screensaver
+        while self._display.pending_events():
+            event = self._display.next_event()
+            if event.type == self._saver_event:
+                self._saver_active = event.state == screensaver.StateOn
+
+    def _run_lock_command(self):
+        try:
+            result = subprocess.run(self.lock_command, shell=True, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL, timeout=self.poll_interval)
+            self._command_locked = result.returncode == 0
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self._logger.warning(f"Lock command '{self.lock_command}' failed: {e}")
+        stats.count("lock_command_runs")
+
+    def _update(self):
+        locked = self._saver_active or self._command_locked
+        if locked == self.locked:
+            return
+        self.locked = locked
+        if locked:
+            self._logger.info("Screen locked, pausing")
+            stats.count("locks")
+            self.OnLock()
+        else:
+            self._logger.info("Screen unlocked, resuming")
+            self.OnUnlock()
+
+    def run(self):
+        poll = select.poll()
+        poll.register(self._wake_read, select.POLLIN)
+        if self._display:
+            poll.register(self._display.fileno(), select.POLLIN)
+        timeout = self.poll_interval * 1000 if self.lock_command else None
+        try:
+            if not self._display and not self.lock_command:
+                self._logger.warning("No source for the lock state, locking is not noticed")
+                return
+            while not self.finished.is_set():
+                if self.lock_command:
+                    self._run_lock_command()
+                if self._display:
+                    self._read_screensaver()
+                self._update()
+                if any(fd == self._wake_read for fd, _ in poll.poll(timeout)):
+                    return
+        finally:
+            if self._display:
+                self._display.close()
+            for fd in self._wake_read, self._wake_write:
+                os.close(fd)
+
+    def cancel(self):
+        self.finished.set()
+        try:
+            os.write(self._wake_write, b"\0")
+        except OSError:
+            # thread already finished and closed the pipe
+            pass
@@ -0,0 +1,47 @@
+"""
+Deduplicated and rate limited logging for warnings on the hot path (key hook, drawing)
+"""
+import threading
+import time
+from logging import WARNING, getLogger
+
+from i3razer.stats import stats
+
+
+class LogLimiter:
+    """
+    Logs each message (identified by its unformatted text or the given key) at most once per interval.
+    The arguments are only formatted by logging when a message is written, repeats within the interval
+    are counted in the stats (log_suppressed) and their number is added to the next written message
+    """
+
+    def __init__(self, logger=None, interval=60.0):
+        if not logger:
+            logger = getLogger(__name__)
+        self._logger = logger
+        self.interval = interval
+        self._last = {}  # key -> [monotonic time of the last written message, suppressed repeats]
+        self._lock = threading.Lock()
+
+    def log(self, level, msg, *args, key=None):
+        """
+        key: identifies repeats of the message, defaults to msg
+        """
+        if key is None:
+            key = msg
+        now = time.monotonic()
+        with self._lock:
+            entry = self._last.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                stats.count("log_suppressed")
+                return
+            suppressed = entry[1] if entry else 0
+            self._last[key] = [now, 0]
+        if suppressed:
+            self._logger.log(level, msg + " (%d more times since the last message)", *args, suppressed)
+        else:
+            self._logger.log(level, msg, *args)
+
+    def warning(self, msg, *args, key=None):
+        self.log(WARNING, msg, *args, key=key)
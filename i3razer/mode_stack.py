@@ -0,0 +1,64 @@
+"""
+Stack of the modes left with push_mode, pop_mode returns to the mode on top and redraws its cached frame
+"""
+from i3razer.stats import stats
+
+MAX_DEPTH = 16  # a deeper stack forgets its oldest entry
+
+
+class StackEntry:
+    """
+    A mode left with push_mode
+    snapshot: the snapshot the mode and the compositor belong to, after a reload the mode is looked up by name
+    mode: the compiled Mode
+    scheme_name: name of the color scheme shown when the mode was left
+    compositor: copy of the layers shown when the mode was left, None if a hardware effect was shown
+    """
+    __slots__ = ("snapshot", "mode", "scheme_name", "compositor")
+
+    def __init__(self, snapshot, mode, scheme_name, compositor):
+        self.snapshot = snapshot
+        self.mode = mode
+        self.scheme_name = scheme_name
+        self.compositor = compositor
+
+
+class ModeStack:
+    """
+    Bounded stack of StackEntries, its depth and the bytes of the cached frames are kept in the stats
+    """
+
+    def __init__(self, max_depth=MAX_DEPTH):
+        self.max_depth = max_depth
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def push(self, entry):
+        self._entries.append(entry)
+        if len(self._entries) > self.max_depth:
+            del self._entries[0]
+            stats.count("mode_stack.dropped")
+        self._update_stats()
+
+    def pop(self):
+        """
+        returns the entry on top of the stack, None if it is empty
+        """
+        if not self._entries:
+            return None
+        entry = self._entries.pop()
+        self._update_stats()
+        return entry
+
+    def names(self):
+        """
+        returns the names of the modes on the stack, the top last
+        """
+        return [entry.mode.name for entry in self._entries]
+
+    def _update_stats(self):
+        stats.set("mode_stack.depth", len(self._entries))
+        stats.set("mode_stack.cached_bytes", sum(entry.compositor.nbytes for entry in self._entries
+                                                 if entry.compositor))
@@ -9,15 +9,35 @@
 import logging
 import re
 import sys
-import threading
 import time
 
 from Xlib import X, XK, display
 from Xlib.ext import record
 from Xlib.protocol import rq
 
+from i3razer.event_record import EventWriter
+from i3razer.key_hook import KeyHook
+from i3razer.stats import stats
 
-class HookManager(threading.Thread):
+
+# need the following because XK.keysym_to_string() only does printable
+# chars rather than being the correct inverse of XK.string_to_keysym()
+# keysym -> name, built once. For keysyms with several names the first one of dir(XK) is used.
+# lstrip removes all leading X, K and _ (e.g. 'P_Home' for XK_KP_Home), the layouts use these names
+_KEYSYM_NAMES = {}
+for _name in dir(XK):
+    if _name.startswith("XK_"):
+        _KEYSYM_NAMES.setdefault(getattr(XK, _name), _name.lstrip("XK_"))
+
+
+def keysym_to_name(keysym):
+    name = _KEYSYM_NAMES.get(keysym)
+    if name is None:
+        return f"[{keysym}]"
+    return name
+
+
+class HookManager(KeyHook):
     """ This is the main class. Instantiate it, and you can hand it KeyDown
         and KeyUp (functions in your own code) which execute to parse the
         pyxhookkeyevent class that is returned.
@@ -29,11 +49,16 @@ class HookManager(threading.Thread):
         KeyUp   : The function to execute when a key is released, if it
                   returns anything. It hands the function an argument that is
                   the pyxhookkeyevent class.
+
+        record_file : if given, every key event is written to this file
+                      (see i3razer.event_record), it can be replayed later.
+
+        Only key events are recorded. With set_relevant_keys() the events
+        handed to KeyDown and KeyUp can be narrowed further (see KeyHook).
     """
 
-    def __init__(self, parameters=False):
-        threading.Thread.__init__(self)
-        self.finished = threading.Event()
+    def __init__(self, parameters=False, record_file=None):
+        KeyHook.__init__(self)
 
         # Give these some initial values
         self.mouse_position_x = 0
@@ -55,13 +80,18 @@ class HookManager(threading.Thread):
         self.MouseButtonUp = self.lambda_function
         self.MouseMovement = self.lambda_function
 
-        self.contextEventMask = [X.KeyPress, X.MotionNotify]
+        self.contextEventMask = [X.KeyPress, X.KeyRelease]
+        # focus changes of grabs, the pressed keys are read again after them
+        self.contextDeliveredMask = [X.FocusIn, X.FocusOut]
+        self._grab_mode = X.NotifyUngrab
 
         # Hook to our display.
         self.local_dpy = display.Display()
         self.record_dpy = display.Display()
         self.context = None  # Context initialized in run
 
+        self._recorder = EventWriter(record_file) if record_file else None
+
     def run(self):
         # Check if the extension is present
         if not self.record_dpy.has_extension("RECORD"):
@@ -78,8 +108,7 @@ class HookManager(threading.Thread):
                 'core_replies':     (0, 0),
                 'ext_requests':     (0, 0, 0, 0),
                 'ext_replies':      (0, 0, 0, 0),
-                'delivered_events': (0, 0),
-                #                (X.KeyPress, X.ButtonPress),
+                'delivered_events': tuple(self.contextDeliveredMask),
                 'device_events':    tuple(self.contextEventMask),
                 'errors':           (0, 0),
                 'client_started':   False,
@@ -97,6 +126,8 @@ class HookManager(threading.Thread):
         self.finished.set()
         self.local_dpy.record_disable_context(self.context)
         self.local_dpy.flush()
+        if self._recorder:
+            self._recorder.close()
 
     @staticmethod
     def print_event(event):
@@ -122,11 +153,23 @@ class HookManager(threading.Thread):
                 None
             )
             if event.type == X.KeyPress:
-                hook_event = self._key_press_event(event)
-                self.KeyDown(hook_event)
+                if self._recorder and not self.paused:
+                    self._record(event, True)
+                if self._press(event.detail):
+                    hook_event = self._key_press_event(event)
+                    self.KeyDown(hook_event)
             elif event.type == X.KeyRelease:
-                hook_event = self._key_release_event(event)
-                self.KeyUp(hook_event)
+                if self._recorder and not self.paused:
+                    self._record(event, False)
+                if self._release(event.detail):
+                    hook_event = self._key_release_event(event)
+                    self.KeyUp(hook_event)
+            elif event.type in (X.FocusIn, X.FocusOut):
+                # a grab starts or ends, reported once for every window losing or getting the focus
+                if event.mode in (X.NotifyGrab, X.NotifyUngrab) and event.mode != self._grab_mode:
+                    self._grab_mode = event.mode
+                    if self.resync():
+                        self.OnResync()
             # Only Keyboard events, ignore mouse
 
             # elif event.type == X.ButtonPress:
@@ -142,6 +185,10 @@ class HookManager(threading.Thread):
             # hook_event = self._mouse_move_event(event)
             # self.MouseMovement(hook_event)
 
+    def _record(self, event, pressed):
+        keysym = self.local_dpy.keycode_to_keysym(event.detail, 0)
+        self._recorder.write(event.time, keysym, event.detail, pressed)
+
     def _key_press_event(self, event):
         # Always take the first keysym, shift is not handled
         # Shift will make a different key released, if press is without shift
@@ -169,20 +216,27 @@ class HookManager(threading.Thread):
 
     def reset_keysyms(self):
         self._keysym_names = {}
+        KeyHook.reset_keysyms(self)
+
+    def keycode_name(self, keycode):
+        return self.lookup_keyname(self.local_dpy.keycode_to_keysym(keycode, 0))
+
+    def query_pressed(self):
+        # one QueryKeymap request: bit n of the 32 bytes is set if keycode n is pressed
+        try:
+            keymap = self.local_dpy.query_keymap()
+        except Exception as e:
+            logging.warning(f"QueryKeymap failed: {e}")
+            return None
+        return {index * 8 + bit for index, byte in enumerate(keymap) if byte for bit in range(8) if byte >> bit & 1}
 
-    # need the following because XK.keysym_to_string() only does printable
-    # chars rather than being the correct inverse of XK.string_to_keysym()
     def lookup_keyname(self, keysym):
         # save keysym names internal for faster access (it is called on every key event, should be fast)
         if keysym in self._keysym_names:
+            stats.cache("keysym_names", True)
             return self._keysym_names[keysym]
-        keyname = ""
-        for name in dir(XK):
-            if name.startswith("XK_") and getattr(XK, name) == keysym:
-                keyname = name.lstrip("XK_")
-                break
-        if not keyname:
-            keyname = f"[{keysym}]"
+        stats.cache("keysym_names", False)
+        keyname = keysym_to_name(keysym)
         self._keysym_names[keysym] = keyname
         return keyname
 
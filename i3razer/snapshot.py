@@ -0,0 +1,207 @@
+import threading
+from difflib import get_close_matches
+from logging import getLogger
+
+from i3razer.config_model import StaticScheme
+from i3razer.frame import new_frame, set_color
+from i3razer.stats import stats
+
+
+class Snapshot:
+    """
+    Everything the event handling reads from config and layout, bundled in one immutable object:
+        config: the ConfigParser, which is not read again after the snapshot is built
+        layout: key name -> (row, col) of the keyboard layout
+        rows, cols: size of the keyboard matrix
+        listen_keys: mode name -> keys which could change the color scheme in this mode
+        i3_modes: i3 mode name -> mode name
+        frames: scheme name -> prerendered frame of each static color scheme, a view into the frame bank if one
+                is given (see frame_bank.py)
+        deltas: (base scheme name, scheme name) -> cells where the frame of the scheme differs from the base frame
+        unknown_keys: keys of the reachable modes and schemes which are not in the layout or outside of the matrix,
+                      reported once when the snapshot is built and skipped silently on rendering
+
+    A snapshot is built before it is used. Reloading builds a new snapshot and publishes it with
+    a single assignment, so a thread handling an event always sees either the old or the new snapshot.
+    Only modes and schemes compiled by the config (the reachable ones) are prepared on building.
+    The attributes never change after building, except for the caches listen_keys, frames and deltas:
+    modes and schemes which are not reachable are added to listen_keys and frames when they are requested with
+    get_listen_keys() and get_frame() (the config compiles them on request, see ConfigParser), deltas are computed
+    on the first get_delta(). Caches only gain entries, an entry is never replaced. Missing entries are computed
+    under cache_lock, reading uses a single dict.get, which sees an entry either completely or not at all.
+    """
+    __slots__ = ("config", "layout", "layout_name", "rows", "cols", "listen_keys", "i3_modes", "frames", "deltas",
+                 "unknown_keys", "switch_keys", "bank", "cache_lock", "logger")
+
+    def __init__(self, config, layout_name, layout, rows, cols, logger=None, switch_keys=True, bank=None):
+        """
+        switch_keys: False -> modes are switched by i3 and not by key presses, switch keys need no listening
+        bank: FrameBank of the config, layout and size, its frames are used instead of rendering them
+        """
+        if not logger:
+            logger = getLogger(__name__)
+        set_ = object.__setattr__
+        set_(self, "config", config)
+        set_(self, "layout_name", layout_name)
+        set_(self, "layout", dict(layout))
+        set_(self, "rows", rows)
+        set_(self, "cols", cols)
+        set_(self, "switch_keys", switch_keys)
+        set_(self, "bank", bank)
+        set_(self, "cache_lock", threading.RLock())  # reentrant, get_delta() fills frames
+        set_(self, "logger", logger)
+        with stats.timed("snapshot.check_keys"):
+            set_(self, "unknown_keys", self._check_keys(config, logger))
+
+        modes = config.get_modes()
+        with stats.timed("snapshot.listen_keys"):
+            set_(self, "listen_keys", {name: frozenset(config.get_important_keys_mode(modes[name], switch_keys))
+                                       for name in modes})
+        set_(self, "i3_modes", config.get_i3_modes())
+
+        frames = {}
+        schemes = config.get_color_schemes()
+        with stats.timed("snapshot.frames"):
+            for name in schemes:
+                if isinstance(schemes[name], StaticScheme):
+                    frame = self._get_banked(name) or bytes(self._render_static_scheme(schemes[name], logger))
+                    frames[name] = frame
+        set_(self, "frames", frames)
+        set_(self, "deltas", {})
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Snapshot is immutable")
+
+    def _check_keys(self, config, logger):
+        """
+        resolves every key of the config against the layout and logs one report of the unknown keys,
+        with close matches of the layout as suggestions
+        returns: the unknown keys
+        """
+        unknown = {}
+        for key, places in config.get_key_references().items():
+            position = self.layout.get(key)
+            if position is None:
+                matches = get_close_matches(key, self.layout, n=3)
+                hint = f", did you mean {', '.join(matches)}?" if matches else ""
+                unknown[key] = f"  '{key}' in {', '.join(sorted(places))}{hint}"
+            elif position[0] >= self.rows or position[1] >= self.cols:
+                unknown[key] = f"  '{key}' in {', '.join(sorted(places))} is at {position}, outside of the " \
+                               f"keyboard matrix"
+        if unknown:
+            stats.count("unknown_keys", len(unknown))
+            logger.warning(f"{len(unknown)} keys of the config not found in layout '{self.layout_name}':\n"
+                           + "\n".join(unknown[key] for key in sorted(unknown)))
+        return frozenset(unknown)
+
+    def get_listen_keys(self, mode_name):
+        """
+        returns the keys which could change the color scheme in the mode, None if there is no such mode
+        """
+        keys = self.listen_keys.get(mode_name)
+        if keys is None:
+            mode = self.config.get_mode_by_name(mode_name)
+            if not mode:
+                return None
+            with self.cache_lock:
+                keys = self.listen_keys.get(mode_name)
+                if keys is None:
+                    keys = self.listen_keys[mode_name] = frozenset(self.config.get_important_keys_mode(
+                        mode, self.switch_keys))
+        return keys
+
+    def get_frame(self, scheme):
+        """
+        returns the frame of the static color scheme
+        """
+        frame = self.frames.get(scheme.name)
+        stats.cache("frames", frame is not None)
+        if frame is None:
+            with self.cache_lock:
+                frame = self.frames.get(scheme.name)
+                if frame is None:
+                    frame = self._get_banked(scheme.name) or bytes(self._render_static_scheme(scheme, self.logger))
+                    self.frames[scheme.name] = frame
+        return frame
+
+    def _get_banked(self, scheme_name):
+        """
+        returns the frame of the scheme in the frame bank, None without bank or if the scheme is not in it
+        """
+        return self.bank.get(scheme_name) if self.bank else None
+
+    def get_delta(self, base, scheme):
+        """
+        returns the cells (cell -> color bytes) in which the frame of the static scheme differs from the base scheme
+        """
+        key = (base.name, scheme.name)
+        delta = self.deltas.get(key)
+        stats.cache("deltas", delta is not None)
+        if delta is None:
+            with self.cache_lock:
+                delta = self.deltas.get(key)
+                if delta is None:
+                    base_frame = self.get_frame(base)
+                    frame = self.get_frame(scheme)
+                    # bytes of the colors, frames of a frame bank are views
+                    delta = {index // 3: bytes(frame[index:index + 3]) for index in range(0, len(frame), 3)
+                             if frame[index:index + 3] != base_frame[index:index + 3]}
+                    self.deltas[key] = delta
+        return delta
+
+    def get_cells(self, keys):
+        """
+        returns the cells (row * cols + col) of the keys, keys not in the layout or matrix are left out
+        """
+        cells = []
+        for key in keys:
+            position = self.layout.get(key)
+            if position and position[0] < self.rows and position[1] < self.cols:
+                cells.append(position[0] * self.cols + position[1])
+        return cells
+
+    def _render_static_scheme(self, scheme, logger):
+        """
+        returns the frame of a static color scheme, including the inherited schemes
+        """
+        frame = new_frame(self.rows, self.cols)
+        self._add_to_frame(frame, scheme, set(), logger)
+        return frame
+
+    def _add_to_frame(self, frame, scheme, drawing_schemes, logger):
+        """
+        Adds a color scheme and its inherited color schemes to the frame
+        drawing_schemes: prevent infinite inherit loop in color schemes
+        """
+        # assert scheme type is static
+        if not isinstance(scheme, StaticScheme):
+            logger.warning(f"trying to inherit a non static color scheme '{scheme.name}")
+            return
+
+        # handle infinite loop
+        if scheme.name in drawing_schemes:
+            # should be detected on reading config
+            logger.warning(f"color scheme '{scheme.name}' is in an inherit loop with {drawing_schemes}")
+            return
+        drawing_schemes.add(scheme.name)
+
+        # set colors, the inherited scheme is drawn at the position of its field
+        for index, (keys, color) in enumerate(scheme.assignments):
+            if index == scheme.inherit_index and scheme.inherit:
+                self._add_inherited(frame, scheme, drawing_schemes, logger)
+            self._set_keys(frame, self.layout.keys() if keys is None else keys, color, logger)
+        if scheme.inherit_index == len(scheme.assignments) and scheme.inherit:
+            self._add_inherited(frame, scheme, drawing_schemes, logger)
+
+        drawing_schemes.remove(scheme.name)
+
+    def _add_inherited(self, frame, scheme, drawing_schemes, logger):
+        add_scheme = self.config.get_color_scheme_by_name(scheme.inherit)
+        self._add_to_frame(frame, add_scheme, drawing_schemes, logger)
+
+    def _set_keys(self, frame, keys, color, logger):
+        for key in keys:
+            position = self.layout.get(key)
+            if position is not None and position[0] < self.rows and position[1] < self.cols:
+                set_color(frame, self.cols, position, color)
+            # else: unknown key, reported once in _check_keys()
@@ -0,0 +1,173 @@
+"""
+Runtime counters and a sampling profiler to look inside a running instance
+SIGUSR1 dumps the counters, SIGUSR2 starts / stops the profiler (see install_signal_handlers)
+"""
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from logging import getLogger
+
+
+class Stats:
+    """
+    Collects counters, cache hit rates and call timings.
+    Updating is done without locks, counters can be off by a few if threads race
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = Counter()
+        self.cache_hits = Counter()
+        self.cache_misses = Counter()
+        self.timings = {}  # name: [calls, total seconds, max seconds]
+        self.samples = {}  # name: the latest durations in seconds, for percentiles
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def set(self, name, value):
+        """
+        sets a counter to a current value, e.g. the size of a cache
+        """
+        self.counters[name] = value
+
+    def cache(self, name, hit):
+        if hit:
+            self.cache_hits[name] += 1
+        else:
+            self.cache_misses[name] += 1
+
+    def add_timing(self, name, seconds):
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            if seconds > timing[2]:
+                timing[2] = seconds
+
+    def add_sample(self, name, seconds, keep=2048):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=keep)
+        samples.append(seconds)
+
+    @contextmanager
+    def timed(self, name):
+        """
+        measures the time of the with block, e.g. a D-Bus call
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(name, time.perf_counter() - start)
+
+    def report(self) -> str:
+        """
+        returns all collected values as readable text
+        """
+        lines = [f"i3razer stats after {time.monotonic() - self.started:.0f}s"]
+        for name in sorted(self.counters):
+            lines.append(f"  {name}: {self.counters[name]}")
+        for name in sorted(set(self.cache_hits) | set(self.cache_misses)):
+            hits, misses = self.cache_hits[name], self.cache_misses[name]
+            lines.append(f"  cache {name}: {hits} hits, {misses} misses ({100 * hits / (hits + misses):.1f}% hit rate)")
+        for name in sorted(self.timings):
+            calls, total, maximum = self.timings[name]
+            lines.append(f"  {name}: {calls} calls, avg {1000 * total / calls:.2f}ms, max {1000 * maximum:.2f}ms")
+        for name in sorted(self.samples):
+            samples = sorted(self.samples[name])
+            if samples:
+                p50, p90, p99 = (samples[min(len(samples) - 1, len(samples) * p // 100)] for p in (50, 90, 99))
+                lines.append(f"  {name}: {len(samples)} samples, p50 {1000 * p50:.2f}ms, p90 {1000 * p90:.2f}ms, "
+                             f"p99 {1000 * p99:.2f}ms, max {1000 * samples[-1]:.2f}ms")
+        return "\n".join(lines)
+
+
+stats = Stats()
+
+
+class SamplingProfiler(threading.Thread):
+    """
+    Samples the stacks of other threads in an interval and counts them.
+    The result is written in the collapsed stack format (one 'thread;frame;frame count' per line),
+    which can be read by flamegraph tools
+    """
+
+    def __init__(self, interval=0.005, thread_ids=None):
+        """
+        interval: seconds between two samples
+        thread_ids: threads to sample, if None all threads except the main thread are sampled
+        """
+        threading.Thread.__init__(self, name="i3razer-profiler", daemon=True)
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.samples = Counter()
+        self.finished = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        main_id = threading.main_thread().ident
+        while not self.finished.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if self.thread_ids is None and thread_id == main_id:
+                    continue
+                if self.thread_ids is not None and thread_id not in self.thread_ids:
+                    continue
+                stack = []
+                while frame:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def cancel(self):
+        self.finished.set()
+
+    def write(self, profile_file):
+        with open(profile_file, "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+def install_signal_handlers(profile_file=None, logger=None):
+    """
+    SIGUSR1: write the stats report to stderr
+    SIGUSR2: start the sampling profiler, on the next SIGUSR2 stop it and write the profile to profile_file
+    Must be called from the main thread
+    """
+    if not logger:
+        logger = getLogger(__name__)
+    if not profile_file:
+        profile_file = os.path.join(tempfile.gettempdir(), f"i3razer-{os.getpid()}.profile")
+    profiler = None
+
+    def dump_stats(signum, frame):
+        print(stats.report(), file=sys.stderr, flush=True)
+
+    def toggle_profiler(signum, frame):
+        nonlocal profiler
+        if profiler is None:
+            profiler = SamplingProfiler()
+            profiler.start()
+            logger.warning("Profiler started")
+        else:
+            profiler.cancel()
+            profiler.join()
+            profiler.write(profile_file)
+            logger.warning(f"Profiler stopped, {sum(profiler.samples.values())} samples written to '{profile_file}'")
+            profiler = None
+
+    signal.signal(signal.SIGUSR1, dump_stats)
+    signal.signal(signal.SIGUSR2, toggle_profiler)
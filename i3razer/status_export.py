@@ -0,0 +1,151 @@
+"""
+Exports mode, color scheme and pressed keys of a running i3razer into a small memory mapped file for status bars.
+
+The file has a fixed layout of text lines, every value is padded with spaces to the width of its field:
+    I3RAZER 1
+    seq <20 digits>
+    mode <63 characters>
+    scheme <63 characters>
+    pressed <127 characters>    pressed keys joined by '+'
+so it can be read with a single read or cat, or polled through mmap without any call to i3razer.
+seq is odd while a change is written and incremented to the next even number afterwards, readers which see an odd
+or changed seq read again. After each change the modification time of the file is set, which can be waited for
+with inotify (IN_ATTRIB), see wait_for_change() or 'inotifywait -e attrib FILE'.
+"""
+import mmap
+import os
+import select
+import threading
+import time
+
+from i3razer import inotify
+
+HEADER = b"I3RAZER 1\n"
+_FIELDS = (("seq", 20), ("mode", 63), ("scheme", 63), ("pressed", 127))
+
+
+def _layout():
+    offsets = {}
+    offset = len(HEADER)
+    for name, width in _FIELDS:
+        offset += len(name) + 1
+        offsets[name] = (offset, width)
+        offset += width + 1
+    return offsets, offset
+
+
+OFFSETS, SIZE = _layout()
+
+
+def default_status_file():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "i3razer.status")
+    return f"/tmp/i3razer-{os.getuid()}.status"
+
+
+def _field(name, value) -> bytes:
+    width = OFFSETS[name][1]
+    return value.encode()[:width].ljust(width)
+
+
+class StatusExport:
+    """
+    Writer of the status file, keeps it mapped and only writes changed values
+    """
+
+    def __init__(self, status_file=None):
+        self.status_file = status_file or default_status_file()
+        self._lock = threading.Lock()
+        self._values = None
+        self._seq = 0
+
+        tmp_file = f"{self.status_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as file:
+            file.write(HEADER)
+            for name, width in _FIELDS:
+                file.write(name.encode() + b" " + _field(name, "0" * width if name == "seq" else "") + b"\n")
+        os.replace(tmp_file, self.status_file)
+        self._fd = os.open(self.status_file, os.O_RDWR)
+        self._map = mmap.mmap(self._fd, SIZE)
+
+    def update(self, mode, scheme, pressed_keys):
+        """
+        publishes the values, nothing is written if they did not change
+        """
+        values = (mode, scheme, frozenset(pressed_keys))
+        if values == self._values:
+            return
+        with self._lock:
+            if self._map is None:
+                return
+            self._values = values
+            self._write_seq(self._seq + 1)
+            for name, value in (("mode", mode), ("scheme", scheme), ("pressed", "+".join(sorted(pressed_keys)))):
+                offset, width = OFFSETS[name]
+                self._map[offset:offset + width] = _field(name, value)
+            self._write_seq(self._seq + 1)
+            os.utime(self._fd)
+
+    def _write_seq(self, seq):
+        self._seq = seq
+        offset, width = OFFSETS["seq"]
+        self._map[offset:offset + width] = str(seq).rjust(width, "0").encode()
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                os.close(self._fd)
+                self._map = None
+
+
+def read_status(status_file=None) -> dict:
+    """
+    returns the consistent values of the status file: seq (int), mode, scheme and pressed (list of keys)
+    """
+    with open(status_file or default_status_file(), "rb") as file:
+        while True:
+            data = file.read(SIZE)
+            file.seek(0)
+            if not data.startswith(HEADER) or len(data) < SIZE:
+                raise ValueError("not an i3razer status file")
+            status = {}
+            for name, (offset, width) in OFFSETS.items():
+                status[name] = data[offset:offset + width].decode(errors="replace").rstrip()
+            seq = int(status["seq"])
+            if seq % 2 == 0:
+                status["seq"] = seq
+                status["pressed"] = status["pressed"].split("+") if status["pressed"] else []
+                return status
+            # a change is written at the moment
+            time.sleep(0.0001)
+
+
+def wait_for_change(seq, status_file=None, timeout=None) -> dict:
+    """
+    blocks until the seq of the status file differs from the given one (or the timeout in seconds passed)
+    return: the values of the status file, see read_status()
+    """
+    status_file = status_file or default_status_file()
+    watcher = inotify.Inotify()
+    try:
+        watcher.add_watch(status_file, inotify.IN_ATTRIB | inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        poll = select.poll()
+        poll.register(watcher.fd, select.POLLIN)
+        while True:
+            # read after watching, so a change in between is not missed
+            status = read_status(status_file)
+            if status["seq"] != seq:
+                return status
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return status
+            if poll.poll(None if remaining is None else remaining * 1000):
+                if any(mask & (inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF)
+                       for _, mask, _ in watcher.read_events()):
+                    # replaced by a restarted i3razer
+                    return read_status(status_file)
+    finally:
+        watcher.close()
@@ -0,0 +1,159 @@
+"""
+Small state file, which survives restarts of i3razer:
+the last drawn mode and scheme per keyboard and facts of the keyboards which are expensive to query over D-Bus
+"""
+import json
+import os
+import threading
+from logging import getLogger
+
+
+BOOT_ID_FILE = "/proc/sys/kernel/random/boot_id"
+
+
+def boot_id():
+    """
+    returns the id of the running boot, "" if unknown
+    """
+    try:
+        with open(BOOT_ID_FILE) as file:
+            return file.read().strip()
+    except OSError:
+        return ""
+
+
+def _is_current(record, daemon):
+    """
+    True if the record was saved on this boot with the daemon of the given D-Bus unique name
+    """
+    boot = boot_id()
+    return bool(record and boot and daemon and record.get("boot") == boot and record.get("daemon") == daemon)
+
+
+def default_state_file():
+    state_home = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+    return os.path.join(state_home, "i3razer", "state.json")
+
+
+class StateStore:
+    """
+    Keeps the state in memory, writing it is delayed by save_delay seconds to write a burst of changes only once
+    """
+
+    def __init__(self, state_file=None, save_delay=1.0, logger=None):
+        if not logger:
+            logger = getLogger(__name__)
+        self._logger = logger
+        self.state_file = state_file or default_state_file()
+        self.save_delay = save_delay
+        self._lock = threading.Lock()
+        self._timer = None
+        self._state = {"devices": {}, "drawn": {}, "color": {}}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.state_file, "r") as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self._logger.warning(f"Ignoring state file '{self.state_file}': {e}")
+            return
+        if isinstance(state, dict):
+            self._state["devices"] = state.get("devices", {})
+            self._state["drawn"] = state.get("drawn", {})
+            self._state["color"] = state.get("color", {})
+
+    def get_device(self, serial):
+        """
+        returns the saved facts (layout, rows, cols, ...) of the keyboard or None
+        """
+        return self._state["devices"].get(serial)
+
+    def get_devices(self) -> dict:
+        """
+        returns serial -> saved facts of all remembered keyboards
+        """
+        return dict(self._state["devices"])
+
+    def set_device(self, serial, facts):
+        """
+        adds the facts to the saved facts of the keyboard
+        """
+        with self._lock:
+            old = self._state["devices"].get(serial) or {}
+            new = {**old, **facts}
+            if new == old:
+                return
+            self._state["devices"][serial] = new
+        self.save_later()
+
+    def get_device_size(self, serial, daemon):
+        """
+        returns the saved (rows, cols) of the keyboard matrix, None if they were not saved on this boot with this
+        daemon (its D-Bus unique name)
+        """
+        facts = self._state["devices"].get(serial)
+        if _is_current(facts, daemon) and facts.get("rows") and facts.get("cols"):
+            return facts["rows"], facts["cols"]
+        return None
+
+    def set_device_size(self, serial, daemon, rows, cols):
+        self.set_device(serial, {"rows": rows, "cols": cols, "boot": boot_id(), "daemon": daemon})
+
+    def get_drawn(self, serial, daemon):
+        """
+        returns the last drawn (mode, scheme, frame digest) on the keyboard or None
+        None as well if the keyboard may show something else since: after a reboot or if the daemon
+        (its D-Bus unique name) changed, e.g. it was restarted or set its default effect on a replug
+        """
+        drawn = self._state["drawn"].get(serial)
+        if _is_current(drawn, daemon):
+            return drawn.get("mode"), drawn.get("scheme"), drawn.get("digest")
+        return None
+
+    def set_drawn(self, serial, daemon, mode, scheme, digest):
+        drawn = {"mode": mode, "scheme": scheme, "digest": digest, "boot": boot_id(), "daemon": daemon}
+        with self._lock:
+            if self._state["drawn"].get(serial) == drawn:
+                return
+            self._state["drawn"][serial] = drawn
+        self.save_later()
+
+    def get_color_correction(self, serial):
+        """
+        returns the saved color correction settings of the keyboard or None
+        """
+        return self._state["color"].get(serial)
+
+    def set_color_correction(self, serial, settings):
+        with self._lock:
+            self._state["color"][serial] = settings
+        self.save_later()
+
+    def save_later(self):
+        with self._lock:
+            if self._timer:
+                return
+            self._timer = threading.Timer(self.save_delay, self.save)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def save(self):
+        """
+        writes the state file atomically
+        """
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            data = json.dumps(self._state, indent=1, sort_keys=True)
+        try:
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            tmp_file = f"{self.state_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as file:
+                file.write(data)
+            os.replace(tmp_file, self.state_file)
+        except OSError as e:
+            self._logger.warning(f"Could not write state file '{self.state_file}': {e}")
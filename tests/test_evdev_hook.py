@@ -0,0 +1,28 @@
+from Xlib import XK
+
+from i3razer.evdev_hook import US_KEYSYM_NAMES, X_KEYCODE_OFFSET, EvdevHook
+from i3razer.layout import layouts
+from i3razer.pyxhook import keysym_to_name
+
+# X names of keys which the en_US layout spells differently, the HookManager does not match them either
+NOT_IN_LAYOUT = {"equal", "bracketleft", "bracketright", "grave", "backslash", "slash", "less", "alt_r", "super_r"}
+
+
+def us_hook():
+    hook = EvdevHook.__new__(EvdevHook)
+    hook._display = None
+    return hook
+
+
+def test_names_equal_hook_manager():
+    hook = us_hook()
+    for code, name in US_KEYSYM_NAMES.items():
+        keysym = XK.string_to_keysym(name)
+        assert keysym, name
+        assert hook.keycode_name(code + X_KEYCODE_OFFSET) == keysym_to_name(keysym), name
+
+
+def test_names_in_en_us_layout():
+    hook = us_hook()
+    missing = {hook.keycode_name(code + X_KEYCODE_OFFSET).lower() for code in US_KEYSYM_NAMES} - set(layouts["en_US"])
+    assert missing <= NOT_IN_LAYOUT